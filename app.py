@@ -21,6 +21,18 @@ st.set_page_config(
     layout="wide",
 )
 
+
+def _render_api_status(slot):
+    """Fill the sidebar status placeholder from session state."""
+    with slot.container():
+        if st.session_state.api_connected:
+            st.success("API: Connected")
+            st.caption(f"Model: {llm_client.LLM_MODEL}")
+        else:
+            st.error("API: Connection failed")
+            st.caption("Go to Settings to configure")
+
+
 with st.sidebar:
     st.title("Legal Document Anonymizer")
     st.caption("PoC v0.1")
@@ -40,20 +52,21 @@ with st.sidebar:
 
     if "api_connected" not in st.session_state:
         with st.spinner("Checking API connection..."):
-            st.session_state.api_connected = llm_client.check_api_connection()
+            st.session_state.api_connected = llm_client.check_api_connection_cached(
+                llm_client.LLM_MODEL, llm_client.LLM_API_BASE
+            )
 
-    if st.session_state.api_connected:
-        st.success("API: Connected")
-        st.caption(f"Model: {llm_client.LLM_MODEL}")
-    else:
-        st.error("API: Connection failed")
-        st.caption("Go to Settings to configure")
+    status_slot = st.empty()
+    _render_api_status(status_slot)
 
     if st.button("Re-check connection"):
         with st.spinner("Checking..."):
             llm_client.reload_config()
-            st.session_state.api_connected = llm_client.check_api_connection()
-            st.rerun()
+            llm_client.check_api_connection_cached.clear()
+            st.session_state.api_connected = llm_client.check_api_connection_cached(
+                llm_client.LLM_MODEL, llm_client.LLM_API_BASE
+            )
+        _render_api_status(status_slot)
 
     st.divider()
 
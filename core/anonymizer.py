@@ -8,32 +8,83 @@ Workflow:
 """
 
 import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
-from core.llm_client import call_llm, parse_json_response
-from core.prompts import PASS1_PROMPT, PASS2_PROMPT
+import requests
+from core import cache, llm_client
+from core.llm_client import (
+    call_llm,
+    get_providers,
+    parse_json_response,
+    supports_prompt_caching,
+)
+from core.matcher import build_matcher, find_matches, apply_edits
+from core.prompts import (
+    PASS1_PROMPT,
+    PASS2_PROMPT_PREFIX,
+    PASS2_SINGLE_FORMAT,
+    PASS2_BATCH_FORMAT,
+)
 from core.section_detector import detect_key_sections
 
+# Character budget for the segments packed into a single Pass 2 request
+PASS2_BATCH_CHARS = 20000
+
+# Ask for JSON mode; parse_json_response() still covers providers that ignore it
+JSON_RESPONSE_FORMAT = {"type": "json_object"}
+
 
 # ============================================================
 # Pass 1: Extract entity definitions and aliases
 # ============================================================
-def run_first_pass(text: str) -> dict:
+def _parse_pass1_response(response_text: str) -> dict:
+    """
+    Parse a Pass 1 response.
+
+    Raises:
+        ValueError: If the response is not a JSON object
+    """
+    result = parse_json_response(response_text)
+    if not isinstance(result, dict):
+        raise ValueError("Pass 1 response is not a JSON object")
+    for key in ("aliases", "entities"):
+        items = result.get(key, [])
+        if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+            raise ValueError(f"Pass 1 response {key} is not an array of objects")
+    return result
+
+
+def run_first_pass(text: str, force: bool = False) -> dict:
     """
     Pass 1: Extract entity definitions and alias relationships from key sections.
+    Results are cached on disk by document hash and model; unchanged documents
+    skip the LLM.
 
     Args:
         text: Full document text
+        force: If True, ignore cached results and LLM responses and rescan
 
     Returns:
         Structured data: {"aliases": [...], "entities": [...]}
     """
+    cache_key = cache.make_key(text, llm_client.LLM_MODEL)
+    if not force:
+        cached = cache.get("pass1", cache_key)
+        if cached is not None:
+            return cached
+
     key_sections = detect_key_sections(text)
 
     prompt = PASS1_PROMPT.format(key_sections_text=key_sections)
     messages = [{"role": "user", "content": prompt}]
 
-    response_text = call_llm(messages)
-    result = parse_json_response(response_text)
+    response_text = call_llm(
+        messages,
+        response_format=JSON_RESPONSE_FORMAT,
+        bypass_cache=force,
+        validate=_parse_pass1_response,
+    )
+    result = _parse_pass1_response(response_text)
 
     if "aliases" not in result:
         result["aliases"] = []
@@ -42,6 +93,7 @@ def run_first_pass(text: str) -> dict:
     if "document_type" not in result:
         result["document_type"] = "Document"
 
+    cache.set("pass1", cache_key, result)
     return result
 
 
@@ -62,13 +114,19 @@ def _split_into_segments(text: str, max_chars: int = 10000) -> list[str]:
     """
     paragraphs = text.split("\n")
     segments = []
-    current_segment = ""
+
+    # Current segment as a list of pieces, joined only when flushed
+    buf: list[str] = []
+    buf_len = 0
+    buf_has_text = False
 
     for paragraph in paragraphs:
         if len(paragraph) > max_chars:
-            if current_segment.strip():
-                segments.append(current_segment.strip())
-                current_segment = ""
+            if buf_has_text:
+                segments.append("".join(buf).strip())
+                buf.clear()
+                buf_len = 0
+                buf_has_text = False
             sentences = re.split(r"(?<=[。.！!？?])\s*", paragraph)
             temp = ""
             for sentence in sentences:
@@ -80,14 +138,19 @@ def _split_into_segments(text: str, max_chars: int = 10000) -> list[str]:
                 segments.append(temp.strip())
             continue
 
-        if len(current_segment) + len(paragraph) + 1 > max_chars and current_segment.strip():
-            segments.append(current_segment.strip())
-            current_segment = ""
+        if buf_len + len(paragraph) + 1 > max_chars and buf_has_text:
+            segments.append("".join(buf).strip())
+            buf.clear()
+            buf_len = 0
+            buf_has_text = False
 
-        current_segment += paragraph + "\n"
+        buf.append(paragraph)
+        buf.append("\n")
+        buf_len += len(paragraph) + 1
+        buf_has_text = buf_has_text or bool(paragraph.strip())
 
-    if current_segment.strip():
-        segments.append(current_segment.strip())
+    if buf_has_text:
+        segments.append("".join(buf).strip())
 
     return segments
 
@@ -102,10 +165,17 @@ def _build_alias_context(pass1_result: dict) -> str:
     Returns:
         Formatted alias context string
     """
+    # Sorted so the Pass 2 prompt prefix is byte-identical for the same
+    # entities regardless of the order Pass 1 (or the user) listed them
+    alias_groups = sorted(
+        pass1_result.get("aliases", []),
+        key=lambda g: (g.get("type", ""), g.get("canonical", "")),
+    )
+
     lines = []
-    for alias_group in pass1_result.get("aliases", []):
+    for alias_group in alias_groups:
         canonical = alias_group.get("canonical", "")
-        aliases = alias_group.get("aliases", [])
+        aliases = sorted(alias_group.get("aliases", []))
         entity_type = alias_group.get("type", "")
         alias_str = ", ".join(aliases) if aliases else "none"
         lines.append(f"- {canonical} (type: {entity_type}) = {alias_str}")
@@ -116,44 +186,342 @@ def _build_alias_context(pass1_result: dict) -> str:
     return "\n".join(lines)
 
 
-def run_second_pass(
-    text: str,
-    pass1_result: dict,
-    progress_callback=None,
+def _pack_segments(segments: list[str], char_budget: int) -> list[list[str]]:
+    """
+    Greedily pack consecutive segments into batches whose total length stays
+    within char_budget. A segment longer than the budget gets its own batch.
+
+    Args:
+        segments: List of text segments
+        char_budget: Maximum total characters per batch
+
+    Returns:
+        List of segment batches
+    """
+    batches = []
+    batch = []
+    batch_chars = 0
+    for segment in segments:
+        if batch and batch_chars + len(segment) > char_budget:
+            batches.append(batch)
+            batch = []
+            batch_chars = 0
+        batch.append(segment)
+        batch_chars += len(segment)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def _pass2_messages(
+    prompt_prefix: str,
+    output_format: str,
+    segments_text: str,
+    provider=None,
 ) -> list[dict]:
     """
-    Pass 2: Scan full document segment by segment for all sensitive items.
+    Build the chat messages for a Pass 2 call.
+
+    The shared prefix and output format always come first. On providers that
+    support it, they are sent as a separate content part marked with
+    cache_control, so the provider caches the prefix across calls.
 
     Args:
-        text: Full document text
-        pass1_result: Structured data from Pass 1
-        progress_callback: Callback function taking (current_segment, total_segments)
+        prompt_prefix: PASS2_PROMPT_PREFIX filled with the alias context
+        output_format: PASS2_SINGLE_FORMAT or PASS2_BATCH_FORMAT
+        segments_text: Segment text to scan
+        provider: Provider the messages are sent to (None = primary)
 
     Returns:
-        De-duplicated entity list: [{"text": ..., "type": ..., "canonical": ...}, ...]
+        Messages list for call_llm()
     """
-    segments = _split_into_segments(text)
-    alias_context = _build_alias_context(pass1_result)
+    if supports_prompt_caching(provider):
+        content = [
+            {
+                "type": "text",
+                "text": prompt_prefix + output_format,
+                "cache_control": {"type": "ephemeral"},
+            },
+            {"type": "text", "text": segments_text},
+        ]
+    else:
+        content = prompt_prefix + output_format + segments_text
+    return [{"role": "user", "content": content}]
+
+
+def _unwrap_list(response, key: str) -> list | None:
+    """
+    Get the result array from a Pass 2 response: {key: [...]} as requested,
+    or a bare array from models that answer without the wrapper.
 
-    all_entities = []
-    for i, segment in enumerate(segments):
-        if progress_callback:
-            progress_callback(i + 1, len(segments))
+    Returns:
+        The array, or None if the response has neither shape
+    """
+    if isinstance(response, dict):
+        response = response.get(key)
+    return response if isinstance(response, list) else None
+
+
+def _parse_pass2_response(response_text: str, key: str, allow_partial: bool = False) -> list:
+    """
+    Parse a Pass 2 response and get its result array (see _unwrap_list()).
+    allow_partial accepts the complete leading entries of a truncated array
+    (for batch responses, whose missing segments are rescanned).
+
+    Raises:
+        ValueError: If the response has no result array of objects
+    """
+    entries = _unwrap_list(parse_json_response(response_text, allow_partial), key)
+    if entries is None or not all(isinstance(entry, dict) for entry in entries):
+        raise ValueError(f"Pass 2 response has no {key} array of objects")
+    return entries
+
+
+def _scan_segment(
+    segment: str,
+    prompt_prefix: str,
+    provider=None,
+    bypass_cache: bool = False,
+) -> list[dict]:
+    """
+    Scan a single segment with PASS2_SINGLE_FORMAT.
+
+    Args:
+        segment: Document segment text
+        prompt_prefix: PASS2_PROMPT_PREFIX filled with the alias context
+        provider: LLM provider to use (None = primary)
+        bypass_cache: If True, skip the LLM response cache
+
+    Returns:
+        Entities found in the segment
+    """
+    messages = _pass2_messages(prompt_prefix, PASS2_SINGLE_FORMAT, segment, provider)
+
+    response_text = call_llm(
+        messages,
+        response_format=JSON_RESPONSE_FORMAT,
+        provider=provider,
+        bypass_cache=bypass_cache,
+        validate=lambda response: _parse_pass2_response(response, "items"),
+    )
+    return _parse_pass2_response(response_text, "items")
+
+
+def _provider_unavailable(error: Exception) -> bool:
+    """
+    Whether an LLM call error means the provider itself is unusable right now
+    (unreachable, timed out, bad key, rate limited, server error), as opposed
+    to a problem with this request (e.g. 400 context length exceeded).
+    """
+    if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return True
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        status = error.response.status_code
+        return status in (401, 403, 429) or status >= 500
+    return False
+
+
+def _scan_batch_on(
+    batch: list[str],
+    prompt_prefix: str,
+    provider,
+    bypass_cache: bool = False,
+) -> list[list[dict]]:
+    """
+    Scan a batch of segments on one provider in one LLM call using
+    <<<SEG i>>> markers. Segments missing from the response are rescanned one
+    call each; if the response cannot be parsed at all, the whole batch is.
+    Errors that make the provider unusable (see _provider_unavailable()) end
+    the scan on this provider, leaving the remaining segments unscanned.
 
-        prompt = PASS2_PROMPT.format(
-            entity_aliases_context=alias_context,
-            document_segment=segment,
+    Args:
+        batch: Document segments
+        prompt_prefix: PASS2_PROMPT_PREFIX filled with the alias context
+        provider: LLM provider to use
+        bypass_cache: If True, skip the LLM response cache
+
+    Returns:
+        One entity list per segment, in batch order (None where the scan failed)
+    """
+    results = [None] * len(batch)
+
+    if len(batch) > 1:
+        segments_text = "\n".join(
+            f"<<<SEG {i}>>>\n{segment}\n<<<END>>>" for i, segment in enumerate(batch, 1)
         )
-        messages = [{"role": "user", "content": prompt}]
+        messages = _pass2_messages(prompt_prefix, PASS2_BATCH_FORMAT, segments_text, provider)
 
         try:
-            response_text = call_llm(messages)
-            entities = parse_json_response(response_text)
-            if isinstance(entities, list):
-                all_entities.extend(entities)
+            response_text = call_llm(
+                messages,
+                response_format=JSON_RESPONSE_FORMAT,
+                provider=provider,
+                bypass_cache=bypass_cache,
+                validate=lambda response: _parse_pass2_response(response, "segments", True),
+            )
+            entries = _parse_pass2_response(response_text, "segments", allow_partial=True)
+            for entry in entries:
+                items = entry.get("items")
+                if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+                    continue
+                try:
+                    index = int(entry.get("segment")) - 1
+                except (TypeError, ValueError):
+                    continue
+                if 0 <= index < len(batch):
+                    results[index] = entry["items"]
         except Exception as e:
-            print(f"Segment {i + 1} scan failed: {e}")
+            if _provider_unavailable(e):
+                print(f"Batch scan failed on {provider.base}: {e}")
+                return results
+            print(f"Batch scan failed, retrying per segment: {e}")
+
+        missing = results.count(None)
+        if 0 < missing < len(batch):
+            print(f"Batch scan returned no result for {missing} of {len(batch)} segments, retrying those")
+
+    for i, segment in enumerate(batch):
+        if results[i] is not None:
             continue
+        try:
+            results[i] = _scan_segment(segment, prompt_prefix, provider, bypass_cache)
+        except Exception as e:
+            if _provider_unavailable(e):
+                print(f"Segment scan failed on {provider.base}: {e}")
+                break
+            print(f"Segment scan failed: {e}")
+    return results
+
+
+def _scan_batch(
+    batch: list[str],
+    prompt_prefix: str,
+    providers: list,
+    bypass_cache: bool = False,
+) -> list[list[dict]]:
+    """
+    Scan a batch of segments on the first provider, failing over to the next
+    provider for any segments left unscanned.
+
+    Args:
+        batch: Document segments
+        prompt_prefix: PASS2_PROMPT_PREFIX filled with the alias context
+        providers: Providers to try, in order
+        bypass_cache: If True, skip the LLM response cache
+
+    Returns:
+        One entity list per segment, in batch order (None where every provider failed)
+    """
+    results = [None] * len(batch)
+    for attempt, provider in enumerate(providers):
+        missing = [i for i, entities in enumerate(results) if entities is None]
+        if not missing:
+            break
+        if attempt:
+            print(f"Retrying {len(missing)} segment(s) on {provider.base}")
+
+        rescanned = _scan_batch_on([batch[i] for i in missing], prompt_prefix, provider, bypass_cache)
+        for i, entities in zip(missing, rescanned):
+            results[i] = entities
+    return results
+
+
+def iter_second_pass(
+    text: str,
+    pass1_result: dict,
+    force: bool = False,
+):
+    """
+    Pass 2 as a generator: yields each batch's entities as soon as its scan
+    completes, and returns the final de-duplicated entity list and whether
+    every segment was scanned (the generator's return value, as with
+    run_second_pass()).
+
+    Segments are packed into batches of up to PASS2_BATCH_CHARS characters per
+    LLM call. Batches are dealt round-robin across the configured providers and
+    scanned in parallel threads, up to each provider's concurrency limit.
+    Segments a provider fails on are retried on the other providers in turn.
+    A cached (always complete) result for the same document, model and Pass 1
+    result is returned without yielding anything.
+
+    Args:
+        text: Full document text
+        pass1_result: Structured data from Pass 1
+        force: If True, ignore cached results and LLM responses and rescan
+
+    Yields:
+        (scanned_segments, total_segments, entities) in completion order,
+        where entities are the raw (not yet de-duplicated) items of one batch
+
+    Returns:
+        (entities, complete): de-duplicated entity list
+        [{"text": ..., "type": ..., "canonical": ...}, ...], and False if some
+        segments could not be scanned by any provider
+    """
+    providers = get_providers()
+
+    # Keyed on the confirmed Pass 1 result too, so edited aliases rescan
+    models = [provider.model for provider in providers]
+    cache_key = cache.make_key(text, models[0] if len(models) == 1 else models, pass1_result)
+    if not force:
+        cached = cache.get("pass2", cache_key)
+        if cached is not None:
+            return cached, True
+
+    segments = _split_into_segments(text)
+    prompt_prefix = PASS2_PROMPT_PREFIX.format(
+        entity_aliases_context=_build_alias_context(pass1_result)
+    )
+    batches = _pack_segments(segments, PASS2_BATCH_CHARS)
+
+    # Collect per batch, then flatten in document order so de-duplication is stable
+    batch_results = [[None] * len(batch) for batch in batches]
+    scanned = 0
+    # Spread batches over all providers so their rate limits add up; each
+    # provider's semaphore still caps its own requests in flight
+    max_workers = sum(provider.max_concurrency for provider in providers)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # Batch i starts on provider i mod N and fails over to the ones after it
+        futures = {
+            executor.submit(
+                _scan_batch,
+                batch,
+                prompt_prefix,
+                providers[i % len(providers):] + providers[: i % len(providers)],
+                force,
+            ): i
+            for i, batch in enumerate(batches)
+        }
+        try:
+            for future in as_completed(futures):
+                i = futures[future]
+                try:
+                    batch_results[i] = future.result()
+                except Exception as e:
+                    print(f"Batch {i + 1} scan failed: {e}")
+
+                scanned += len(batches[i])
+                yield (
+                    scanned,
+                    len(segments),
+                    [entity for entities in batch_results[i] if entities for entity in entities],
+                )
+        finally:
+            # Consumer stopped early: drop batches that have not started yet
+            for future in futures:
+                future.cancel()
+
+    all_entities = [
+        entity
+        for results in batch_results
+        for entities in results
+        if entities
+        for entity in entities
+    ]
+    # Only cache complete scans; a failed segment should be retried next time
+    complete = all(
+        entities is not None for results in batch_results for entities in results
+    )
 
     # De-duplicate by (text, type)
     seen = set()
@@ -166,7 +534,40 @@ def run_second_pass(
 
     _link_aliases(unique_entities, pass1_result)
 
-    return unique_entities
+    if complete:
+        cache.set("pass2", cache_key, unique_entities)
+    return unique_entities, complete
+
+
+def run_second_pass(
+    text: str,
+    pass1_result: dict,
+    progress_callback=None,
+    force: bool = False,
+) -> tuple[list[dict], bool]:
+    """
+    Pass 2: Scan full document segment by segment for all sensitive items.
+    Runs iter_second_pass() to completion.
+
+    Args:
+        text: Full document text
+        pass1_result: Structured data from Pass 1
+        progress_callback: Callback function taking (scanned_segments, total_segments)
+        force: If True, ignore cached results and LLM responses and rescan
+
+    Returns:
+        (entities, complete): de-duplicated entity list
+        [{"text": ..., "type": ..., "canonical": ...}, ...], and False if some
+        segments could not be scanned by any provider
+    """
+    scan = iter_second_pass(text, pass1_result, force=force)
+    while True:
+        try:
+            scanned, total, _ = next(scan)
+        except StopIteration as stop:
+            return stop.value
+        if progress_callback:
+            progress_callback(scanned, total)
 
 
 def _link_aliases(entities: list[dict], pass1_result: dict):
@@ -178,18 +579,21 @@ def _link_aliases(entities: list[dict], pass1_result: dict):
         entities: Entity list from Pass 2 (modified in place)
         pass1_result: Pass 1 results
     """
+    # Map every known name to its canonical name (first group wins)
+    alias_index = {}
+    for alias_group in pass1_result.get("aliases", []):
+        canonical = alias_group.get("canonical", "")
+        alias_index.setdefault(canonical, canonical)
+        for alias in alias_group.get("aliases", []):
+            alias_index.setdefault(alias, canonical)
+
     for entity in entities:
         if entity.get("canonical"):
             continue
 
-        for alias_group in pass1_result.get("aliases", []):
-            canonical = alias_group.get("canonical", "")
-            aliases = alias_group.get("aliases", [])
-            all_names = [canonical] + aliases
-
-            if entity.get("text") in all_names:
-                entity["canonical"] = canonical
-                break
+        canonical = alias_index.get(entity.get("text"))
+        if canonical is not None:
+            entity["canonical"] = canonical
 
 
 # ============================================================
@@ -269,41 +673,37 @@ def execute_replacement(
         for t in group_info["texts"]:
             text_to_placeholder[t] = placeholder
 
-    # Step 2: Replace longest-first to avoid substring conflicts
-    sorted_texts = sorted(text_to_placeholder.keys(), key=len, reverse=True)
+    # Step 2: Find all occurrences in one pass (longest-first on overlaps)
+    matches = find_matches(build_matcher(text_to_placeholder), text)
 
     replacement_log = []
-    anonymized_text = text
+    edits = []
+    offset = 0
 
-    for entity_text in sorted_texts:
+    for start, end, entity_text in matches:
         placeholder = text_to_placeholder[entity_text]
-
-        search_start = 0
-        while True:
-            pos = anonymized_text.find(entity_text, search_start)
-            if pos == -1:
-                break
-
-            context_before = anonymized_text[max(0, pos - 40) : pos]
-            context_after = anonymized_text[
-                pos + len(entity_text) : pos + len(entity_text) + 40
-            ]
-
-            replacement_log.append({
-                "placeholder": placeholder,
-                "original_text": entity_text,
-                "position": pos,
-                "context_before": context_before,
-                "context_after": context_after,
-            })
-
-            anonymized_text = (
-                anonymized_text[:pos]
-                + placeholder
-                + anonymized_text[pos + len(entity_text) :]
-            )
-
-            search_start = pos + len(placeholder)
+        edits.append((start, end, placeholder))
+
+        # Position in the anonymized text
+        replacement_log.append({
+            "placeholder": placeholder,
+            "original_text": entity_text,
+            "position": start + offset,
+        })
+        offset += len(placeholder) - (end - start)
+
+    anonymized_text = apply_edits(text, edits)
+
+    # Anonymized text within 40 chars of each hit (the context restore_by_context
+    # compares), as merged (start, text) windows instead of the whole document
+    windows = []
+    for entry in replacement_log:
+        lo = max(0, entry["position"] - 40)
+        hi = entry["position"] + len(entry["placeholder"]) + 40
+        if windows and lo <= windows[-1][1]:
+            windows[-1][1] = hi
+        else:
+            windows.append([lo, hi])
 
     # Step 3: Assemble mapping table
     mapping = {
@@ -314,6 +714,8 @@ def execute_replacement(
         },
         "mappings": placeholder_map,
         "replacement_log": replacement_log,
+        # Log entries carry positions only; restoration reads context from here
+        "context_windows": [[lo, anonymized_text[lo:hi]] for lo, hi in windows],
     }
 
     return anonymized_text, mapping
@@ -0,0 +1,128 @@
+"""
+Scan result cache — persists per-document Pass 1 / Pass 2 results on disk.
+
+Results are stored as JSON files under data/cache/<namespace>/, named by a
+BLAKE2b hash of everything that determines them (document text, model, and
+for Pass 2 the confirmed Pass 1 result), so re-uploading the same file skips
+the LLM passes and any change to their inputs misses naturally.
+
+Results contain extracted client data, so they expire after DEFAULT_TTL
+(like the LLM response cache) and expired files are deleted.
+"""
+
+import os
+import json
+import time
+import hashlib
+import tempfile
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "cache")
+
+# Time-to-live for cached results (seconds), matching llm_cache.DEFAULT_TTL
+DEFAULT_TTL = 7 * 24 * 3600
+
+
+def make_key(*parts) -> str:
+    """
+    Build a cache key from strings or JSON-serializable values.
+
+    Args:
+        *parts: Key components (e.g. document text, model name, Pass 1 result)
+
+    Returns:
+        Hex BLAKE2b digest of the components
+    """
+    h = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        if not isinstance(part, str):
+            part = json.dumps(part, ensure_ascii=False, sort_keys=True)
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def _path(namespace: str, key: str) -> str:
+    """Cache file path for a key."""
+    return os.path.join(CACHE_DIR, namespace, f"{key}.json")
+
+
+def get(namespace: str, key: str):
+    """
+    Look up a cached result.
+
+    Args:
+        namespace: Result kind, e.g. "pass1" or "pass2"
+        key: Key from make_key()
+
+    Returns:
+        Cached value, or None if missing, expired, or unreadable
+    """
+    path = _path(namespace, key)
+    try:
+        if time.time() - os.path.getmtime(path) > DEFAULT_TTL:
+            os.unlink(path)
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def set(namespace: str, key: str, value):
+    """
+    Store a result, purging expired results. Written via a temp file +
+    os.replace, so readers never see partial files. Failures are reported
+    and otherwise ignored.
+
+    Args:
+        namespace: Result kind, e.g. "pass1" or "pass2"
+        key: Key from make_key()
+        value: JSON-serializable result
+    """
+    path = _path(namespace, key)
+    tmp_path = None
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(value, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except (OSError, TypeError, ValueError) as e:
+        print(f"Failed to cache {namespace} result: {e}")
+        if tmp_path and os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        return
+
+    _remove_files(os.path.dirname(path), max_age=DEFAULT_TTL)
+
+
+def _remove_files(directory: str, max_age: float = None) -> int:
+    """Delete cache files in a directory (only those older than max_age, if given)."""
+    removed = 0
+    try:
+        entries = list(os.scandir(directory))
+    except OSError:
+        return 0
+    now = time.time()
+    for entry in entries:
+        try:
+            if max_age is None or now - entry.stat().st_mtime > max_age:
+                os.unlink(entry.path)
+                removed += 1
+        except OSError:
+            continue
+    return removed
+
+
+def clear() -> int:
+    """
+    Delete all cached results.
+
+    Returns:
+        Number of files removed
+    """
+    try:
+        namespaces = [entry.path for entry in os.scandir(CACHE_DIR) if entry.is_dir()]
+    except OSError:
+        return 0
+    return sum(_remove_files(namespace) for namespace in namespaces)
@@ -8,7 +8,16 @@ Step C: Canonical name fallback (last resort)
 """
 
 import re
-import difflib
+from bisect import bisect_right
+from collections import deque
+from core.matcher import build_matcher, find_matches, apply_edits
+
+_PLACEHOLDER_RE = re.compile(r"\{[A-Z]+_\d+\}")
+
+
+def _find_placeholders(text: str) -> list[tuple[int, str]]:
+    """Return (position, placeholder) for every placeholder in text."""
+    return [(m.start(), m.group()) for m in _PLACEHOLDER_RE.finditer(text)]
 
 
 # ============================================================
@@ -17,7 +26,8 @@ import difflib
 def restore_by_position(text: str, replacement_log: list[dict]) -> tuple[str, int, int]:
     """
     Restore placeholders using recorded position information.
-    Processes back-to-front to avoid position offset issues.
+    Finds every known placeholder in one pass, then pairs each occurrence
+    with the next log entry for that placeholder recorded within +/- 50 chars.
 
     Args:
         text: Text containing placeholders
@@ -26,101 +36,152 @@ def restore_by_position(text: str, replacement_log: list[dict]) -> tuple[str, in
     Returns:
         (restored_text, matched_count, unmatched_count)
     """
-    matched_count = 0
-    unmatched_count = 0
-
-    sorted_log = sorted(replacement_log, key=lambda x: x["position"], reverse=True)
-
-    for entry in sorted_log:
-        placeholder = entry["placeholder"]
-        original_text = entry["original_text"]
-        position = entry["position"]
-
-        # Search within +/- 50 chars of recorded position
-        search_start = max(0, position - 50)
-        search_end = min(len(text), position + len(placeholder) + 50)
-        search_region = text[search_start:search_end]
-
-        local_pos = search_region.find(placeholder)
-
-        if local_pos != -1:
-            actual_pos = search_start + local_pos
-            text = (
-                text[:actual_pos]
-                + original_text
-                + text[actual_pos + len(placeholder) :]
-            )
-            matched_count += 1
-        else:
-            unmatched_count += 1
+    # Log entries per placeholder, in position order
+    pending = {}
+    for entry in sorted(replacement_log, key=lambda x: x["position"]):
+        pending.setdefault(entry["placeholder"], deque()).append(entry)
+
+    edits = []
+
+    for start, end, placeholder in find_matches(build_matcher(pending), text):
+        queue = pending[placeholder]
+
+        # Entries recorded more than 50 chars before this occurrence cannot match later ones
+        while queue and queue[0]["position"] < start - 50:
+            queue.popleft()
+
+        if queue and queue[0]["position"] <= start + 50:
+            edits.append((start, end, queue.popleft()["original_text"]))
 
-    return text, matched_count, unmatched_count
+    matched_count = len(edits)
+    unmatched_count = len(replacement_log) - matched_count
+
+    return apply_edits(text, edits), matched_count, unmatched_count
 
 
 # ============================================================
 # Step B: Context-based fuzzy matching
 # ============================================================
-def restore_by_context(text: str, replacement_log: list[dict]) -> tuple[str, int]:
+def _ngrams(text: str, n: int = 3) -> frozenset:
+    """Character n-gram set of a string (the whole string if shorter than n)."""
+    if len(text) < n:
+        return frozenset([text]) if text else frozenset()
+    return frozenset(text[i : i + n] for i in range(len(text) - n + 1))
+
+
+def _jaccard(a: frozenset, b: frozenset) -> float:
+    """Jaccard similarity of two n-gram sets (two empty sets count as identical)."""
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def _stored_context(
+    entry: dict, window_starts: list[int], context_windows: list
+) -> tuple[str, str]:
+    """
+    Context around a log entry at anonymization time.
+    Read from the entry itself for older mappings, otherwise sliced from the
+    context window covering the recorded position.
+    """
+    if "context_before" in entry:
+        return entry["context_before"], entry.get("context_after", "")
+
+    i = bisect_right(window_starts, entry["position"]) - 1
+    if i < 0:
+        return "", ""
+    start, window = context_windows[i]
+    pos = entry["position"] - start
+    end = pos + len(entry["placeholder"])
+    return window[max(0, pos - 40) : pos], window[end : end + 40]
+
+
+def restore_by_context(
+    text: str,
+    replacement_log: list[dict],
+    placeholders: list[tuple[int, str]] = None,
+    context_windows: list = None,
+) -> tuple[str, int, list[tuple[int, str]]]:
     """
     Restore remaining placeholders by comparing surrounding context similarity.
-    Uses SequenceMatcher to find the best match from replacement records.
+    Scores candidates by character 3-gram Jaccard similarity of the text
+    before and after each placeholder.
 
     Args:
         text: Text after position-based restoration
         replacement_log: Replacement records
+        placeholders: (position, placeholder) pairs in text, sorted by position
+                      (None = scan text)
+        context_windows: [start, text] windows of the anonymized text around
+                         each hit (from the mapping), used to derive each
+                         entry's stored context
 
     Returns:
-        (restored_text, context_matched_count)
+        (restored_text, context_matched_count, remaining_placeholders)
+        where remaining_placeholders are positions in the restored text
     """
-    context_matched = 0
+    if placeholders is None:
+        placeholders = _find_placeholders(text)
 
-    remaining_placeholders = list(re.finditer(r"\{[A-Z]+_\d+\}", text))
+    if not placeholders:
+        return text, 0, []
 
-    if not remaining_placeholders:
-        return text, 0
+    context_windows = context_windows or []
+    window_starts = [start for start, _ in context_windows]
 
-    for match in reversed(remaining_placeholders):
-        placeholder_text = match.group()
-        pos = match.start()
+    # Group log entries by placeholder with their context n-grams precomputed
+    candidates = {}
+    for entry in replacement_log:
+        stored_before, stored_after = _stored_context(entry, window_starts, context_windows)
+        candidates.setdefault(entry["placeholder"], []).append((
+            _ngrams(stored_before),
+            _ngrams(stored_after),
+            entry,
+        ))
 
-        current_before = text[max(0, pos - 40) : pos]
-        current_after = text[pos + len(placeholder_text) : pos + len(placeholder_text) + 40]
+    edits = []
+    remaining = []
+    offset = 0
+
+    for pos, placeholder_text in placeholders:
+        end = pos + len(placeholder_text)
 
         best_score = 0
         best_entry = None
 
-        for entry in replacement_log:
-            if entry["placeholder"] != placeholder_text:
-                continue
-
-            stored_before = entry.get("context_before", "")
-            stored_after = entry.get("context_after", "")
-
-            score_before = difflib.SequenceMatcher(
-                None, current_before, stored_before
-            ).ratio()
-            score_after = difflib.SequenceMatcher(
-                None, current_after, stored_after
-            ).ratio()
+        entries = candidates.get(placeholder_text)
+        if entries:
+            current_before = _ngrams(text[max(0, pos - 40) : pos])
+            current_after = _ngrams(text[end : end + 40])
 
-            total_score = (score_before + score_after) / 2
+            for stored_before, stored_after, entry in entries:
+                total_score = (
+                    _jaccard(current_before, stored_before)
+                    + _jaccard(current_after, stored_after)
+                ) / 2
 
-            if total_score > best_score:
-                best_score = total_score
-                best_entry = entry
+                if total_score > best_score:
+                    best_score = total_score
+                    best_entry = entry
 
         if best_entry and best_score > 0.5:
             original_text = best_entry["original_text"]
-            text = text[:pos] + original_text + text[pos + len(placeholder_text) :]
-            context_matched += 1
+            edits.append((pos, end, original_text))
+            offset += len(original_text) - len(placeholder_text)
+        else:
+            remaining.append((pos + offset, placeholder_text))
 
-    return text, context_matched
+    return apply_edits(text, edits), len(edits), remaining
 
 
 # ============================================================
 # Step C: Canonical name fallback
 # ============================================================
-def restore_by_canonical(text: str, mappings: dict) -> tuple[str, int]:
+def restore_by_canonical(
+    text: str,
+    mappings: dict,
+    placeholders: list[tuple[int, str]] = None,
+) -> tuple[str, int, list[tuple[int, str]]]:
     """
     Replace remaining placeholders with canonical (formal) names.
     These positions should be manually reviewed by the user.
@@ -128,27 +189,30 @@ def restore_by_canonical(text: str, mappings: dict) -> tuple[str, int]:
     Args:
         text: Text still containing placeholders
         mappings: Mapping table (placeholder -> info)
+        placeholders: (position, placeholder) pairs in text, sorted by position
+                      (None = scan text)
 
     Returns:
-        (restored_text, fallback_count)
+        (restored_text, fallback_count, remaining_placeholders)
+        where remaining_placeholders are positions in the restored text
     """
-    fallback_count = 0
+    if placeholders is None:
+        placeholders = _find_placeholders(text)
 
-    remaining = list(re.finditer(r"\{[A-Z]+_\d+\}", text))
+    edits = []
+    remaining = []
+    offset = 0
 
-    for match in reversed(remaining):
-        placeholder_text = match.group()
-        pos = match.start()
-
-        if placeholder_text in mappings:
-            canonical_name = mappings[placeholder_text].get("value", placeholder_text)
-        else:
+    for pos, placeholder_text in placeholders:
+        if placeholder_text not in mappings:
+            remaining.append((pos + offset, placeholder_text))
             continue
 
-        text = text[:pos] + canonical_name + text[pos + len(placeholder_text) :]
-        fallback_count += 1
+        canonical_name = mappings[placeholder_text].get("value", placeholder_text)
+        edits.append((pos, pos + len(placeholder_text), canonical_name))
+        offset += len(canonical_name) - len(placeholder_text)
 
-    return text, fallback_count
+    return apply_edits(text, edits), len(edits), remaining
 
 
 # ============================================================
@@ -176,13 +240,24 @@ def run_deanonymize(
         text, replacement_log
     )
 
+    # Scan once; steps B and C pass the unresolved placeholders along
+    placeholders = _find_placeholders(text)
+
     # Step B
-    text, context_matched = restore_by_context(text, replacement_log)
+    context_windows = mapping.get("context_windows")
+    if context_windows is None and "anonymized_text" in mapping:
+        # Mappings that stored the whole anonymized text: one window
+        context_windows = [[0, mapping["anonymized_text"]]]
+    text, context_matched, placeholders = restore_by_context(
+        text, replacement_log, placeholders, context_windows
+    )
 
     # Step C
-    text, fallback_count = restore_by_canonical(text, mappings)
+    text, fallback_count, placeholders = restore_by_canonical(
+        text, mappings, placeholders
+    )
 
-    remaining = len(re.findall(r"\{[A-Z]+_\d+\}", text))
+    remaining = len(placeholders)
 
     stats = {
         "position_matched": position_matched,
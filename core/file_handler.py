@@ -6,14 +6,46 @@ Processes headers, footers, tables, and document properties.
 
 import os
 import io
-import json
+import struct
 import subprocess
-import tempfile
+import zipfile
 from datetime import datetime
-from docx import Document
+from functools import lru_cache
+import orjson
+from core.matcher import build_matcher, replace_all
+
+# python-docx, lxml and olefile are imported inside the functions that use
+# them, so app startup doesn't pay for them until a Word file is processed.
 
 MAPPINGS_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "mappings")
 
+# WordprocessingML tags used when streaming document.xml
+_W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+_W_BODY = _W + "body"
+_W_P = _W + "p"
+_W_R = _W + "r"
+_W_HYPERLINK = _W + "hyperlink"
+_W_T = _W + "t"
+_W_BR = _W + "br"
+# Other run children with a fixed text equivalent (as in python-docx run.text)
+_W_RUN_CHARS = {
+    _W + "tab": "\t",
+    _W + "ptab": "\t",
+    _W + "cr": "\n",
+    _W + "noBreakHyphen": "-",
+}
+
+# Word binary (.doc) special characters -> plain text
+_DOC_CHAR_MAP = {
+    0x0D: "\n",  # paragraph mark
+    0x0B: "\n",  # line break
+    0x0C: "\n",  # page / section break
+    0x07: "\t",  # table cell / row mark
+    0x1E: "-",   # non-breaking hyphen
+    0x1F: "",    # optional hyphen
+    **{c: "" for c in range(0x20) if c not in (0x07, 0x09, 0x0A, 0x0B, 0x0C, 0x0D, 0x1E, 0x1F)},
+}
+
 
 def read_uploaded_file(uploaded_file) -> str:
     """
@@ -61,37 +93,185 @@ def _read_txt(uploaded_file) -> str:
 
 
 def _read_docx(uploaded_file) -> str:
-    """Read a .docx file, extracting all paragraph text."""
+    """Read a .docx file, extracting all body paragraph text."""
+    from lxml import etree
+
     content = uploaded_file.read()
-    doc = Document(io.BytesIO(content))
-    paragraphs = [para.text for para in doc.paragraphs]
+    try:
+        return _stream_docx_text(content)
+    except (KeyError, zipfile.BadZipFile, etree.XMLSyntaxError):
+        from docx import Document
+
+        doc = Document(io.BytesIO(content))
+        paragraphs = [para.text for para in doc.paragraphs]
+        return "\n".join(paragraphs)
+
+
+def _stream_docx_text(content: bytes) -> str:
+    """
+    Extract body paragraph text by streaming word/document.xml with iterparse,
+    without building the python-docx object model.
+
+    Args:
+        content: DOCX file bytes
+
+    Returns:
+        Body paragraphs joined by newlines
+    """
+    from lxml import etree
+
+    paragraphs = []
+
+    with zipfile.ZipFile(io.BytesIO(content)) as z, z.open("word/document.xml") as f:
+        for _, el in etree.iterparse(f, events=("end",), tag=_W_P):
+            parent = el.getparent()
+            if parent is None or parent.tag != _W_BODY:
+                continue  # table cell paragraphs are freed with their table
+
+            paragraphs.append(_paragraph_text(el))
+
+            # Free the paragraph and everything before it (including tables)
+            el.clear()
+            while el.getprevious() is not None:
+                del parent[0]
+
     return "\n".join(paragraphs)
 
 
+def _paragraph_text(p) -> str:
+    """
+    Text of a w:p element, the same as python-docx paragraph.text: only the
+    paragraph's own runs (direct or inside hyperlinks) and their direct
+    children count, so text boxes and their mc:Fallback copies are skipped.
+    """
+    parts = []
+    for child in p:
+        if child.tag == _W_R:
+            runs = (child,)
+        elif child.tag == _W_HYPERLINK:
+            runs = child.iterchildren(_W_R)
+        else:
+            continue
+        for run in runs:
+            for node in run:
+                if node.tag == _W_T:
+                    parts.append(node.text or "")
+                elif node.tag == _W_BR:
+                    if node.get(_W + "type", "textWrapping") == "textWrapping":
+                        parts.append("\n")
+                else:
+                    parts.append(_W_RUN_CHARS.get(node.tag, ""))
+    return "".join(parts)
+
+
 def _read_doc(uploaded_file) -> str:
-    """Read a .doc file via macOS textutil conversion."""
+    """Read a .doc file in-process, falling back to macOS textutil."""
     content = uploaded_file.read()
+    try:
+        return _extract_doc_text(content)
+    except (OSError, ValueError, struct.error):
+        return _textutil_convert(content, "doc", "txt").decode("utf-8")
 
-    with tempfile.NamedTemporaryFile(suffix=".doc", delete=False) as tmp_doc:
-        tmp_doc.write(content)
-        tmp_doc_path = tmp_doc.name
 
-    tmp_txt_path = tmp_doc_path.replace(".doc", ".txt")
+def _extract_doc_text(content: bytes) -> str:
+    """
+    Extract the main document text from a Word 97-2003 .doc file by reading
+    the piece table (CLX) from the OLE streams.
 
-    try:
-        result = subprocess.run(
-            ["textutil", "-convert", "txt", "-output", tmp_txt_path, tmp_doc_path],
-            capture_output=True, text=True, timeout=30,
-        )
-        if result.returncode != 0:
-            raise RuntimeError(f"textutil conversion failed: {result.stderr}")
+    Args:
+        content: .doc file bytes
 
-        with open(tmp_txt_path, "r", encoding="utf-8") as f:
-            return f.read()
-    finally:
-        for path in [tmp_doc_path, tmp_txt_path]:
-            if os.path.exists(path):
-                os.unlink(path)
+    Returns:
+        Document text with paragraph marks as newlines and field codes removed
+    """
+    import olefile
+
+    with olefile.OleFileIO(io.BytesIO(content)) as ole:
+        word_doc = ole.openstream("WordDocument").read()
+        flags = struct.unpack_from("<H", word_doc, 0x0A)[0]
+        if flags & 0x0100:
+            raise ValueError("Encrypted .doc files are not supported")
+        table_stream = "1Table" if flags & 0x0200 else "0Table"
+        table = ole.openstream(table_stream).read()
+
+    # FIB: FibBase (32 bytes), then FibRgW, FibRgLw (ccpText is the 4th field),
+    # then FibRgFcLcb (fcClx/lcbClx is the 34th pair)
+    csw = struct.unpack_from("<H", word_doc, 32)[0]
+    rglw_start = 34 + csw * 2
+    cslw = struct.unpack_from("<H", word_doc, rglw_start)[0]
+    ccp_text = struct.unpack_from("<i", word_doc, rglw_start + 2 + 3 * 4)[0]
+    rgfclcb_start = rglw_start + 2 + cslw * 4 + 2
+    fc_clx, lcb_clx = struct.unpack_from("<II", word_doc, rgfclcb_start + 33 * 8)
+    clx = table[fc_clx : fc_clx + lcb_clx]
+
+    # Skip Prc entries to reach the Pcdt (piece table)
+    pos = 0
+    while pos < len(clx) and clx[pos] == 0x01:
+        pos += 3 + struct.unpack_from("<h", clx, pos + 1)[0]
+    if pos >= len(clx) or clx[pos] != 0x02:
+        raise ValueError("Piece table not found in .doc file")
+    lcb_pcd = struct.unpack_from("<I", clx, pos + 1)[0]
+    plc_pcd = clx[pos + 5 : pos + 5 + lcb_pcd]
+
+    piece_count = (lcb_pcd - 4) // 12
+    cps = struct.unpack_from(f"<{piece_count + 1}I", plc_pcd, 0)
+    pcd_start = (piece_count + 1) * 4
+
+    pieces = []
+    for i in range(piece_count):
+        fc = struct.unpack_from("<I", plc_pcd, pcd_start + i * 8 + 2)[0]
+        char_count = cps[i + 1] - cps[i]
+        if fc & 0x40000000:
+            start = (fc & 0x3FFFFFFF) // 2
+            pieces.append(word_doc[start : start + char_count].decode("cp1252", errors="replace"))
+        else:
+            pieces.append(word_doc[fc : fc + 2 * char_count].decode("utf-16-le", errors="replace"))
+
+    text = "".join(pieces)[:ccp_text]
+
+    # Fields are "\x13 code \x14 result \x15"; keep only the result
+    if "\x13" in text:
+        chars = []
+        in_code = []
+        for ch in text:
+            if ch == "\x13":
+                in_code.append(True)
+            elif ch == "\x14":
+                if in_code:
+                    in_code[-1] = False
+            elif ch == "\x15":
+                if in_code:
+                    in_code.pop()
+            elif not any(in_code):
+                chars.append(ch)
+        text = "".join(chars)
+
+    return text.translate(_DOC_CHAR_MAP).rstrip("\n")
+
+
+def _textutil_convert(content: bytes, src_format: str, dst_format: str) -> bytes:
+    """
+    Convert between document formats with macOS textutil, piping through
+    stdin/stdout instead of temp files.
+
+    Args:
+        content: Input file bytes
+        src_format: textutil input format (e.g. "doc", "docx")
+        dst_format: textutil output format (e.g. "txt", "docx", "doc")
+
+    Returns:
+        Converted file bytes
+    """
+    result = subprocess.run(
+        ["textutil", "-format", src_format, "-convert", dst_format, "-stdin", "-stdout"],
+        input=content, capture_output=True, timeout=30,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(
+            f"textutil {src_format}->{dst_format} failed: "
+            f"{result.stderr.decode('utf-8', errors='replace')}"
+        )
+    return result.stdout
 
 
 # ============================================================
@@ -102,6 +282,7 @@ def apply_replacements_to_docx(docx_bytes: bytes, replacements: list[tuple[str,
     """
     Apply text replacements to a DOCX file while preserving formatting.
     Processes body paragraphs, tables, headers, footers, and core properties.
+    All replacements are matched in a single pass per text (longest match wins).
 
     Args:
         docx_bytes: Original DOCX file bytes
@@ -110,16 +291,22 @@ def apply_replacements_to_docx(docx_bytes: bytes, replacements: list[tuple[str,
     Returns:
         Modified DOCX as bytes
     """
+    from docx import Document
+
     doc = Document(io.BytesIO(docx_bytes))
 
+    replacement_map = dict(replacements)
+    matcher = build_matcher(replacement_map)
+
+    def _replace_text(text):
+        return replace_all(matcher, text, replacement_map)
+
     def _replace_in_paragraph(para):
         runs = para.runs
         if not runs:
             return
         full_text = "".join(run.text for run in runs)
-        new_text = full_text
-        for old, new in replacements:
-            new_text = new_text.replace(old, new)
+        new_text = _replace_text(full_text)
         if new_text != full_text:
             runs[0].text = new_text
             for run in runs[1:]:
@@ -139,12 +326,16 @@ def apply_replacements_to_docx(docx_bytes: bytes, replacements: list[tuple[str,
     # Body paragraphs and tables
     _replace_in_container(doc)
 
-    # Headers and footers (all sections)
+    # Headers and footers (all sections); linked sections share one part
+    seen_parts = set()
     for section in doc.sections:
         for hf_attr in ['header', 'footer', 'first_page_header', 'first_page_footer',
                         'even_page_header', 'even_page_footer']:
             try:
                 hf = getattr(section, hf_attr)
+                if id(hf.part) in seen_parts:
+                    continue
+                seen_parts.add(id(hf.part))
                 _replace_in_container(hf)
             except Exception:
                 continue
@@ -157,9 +348,7 @@ def apply_replacements_to_docx(docx_bytes: bytes, replacements: list[tuple[str,
             try:
                 val = getattr(props, attr, None)
                 if val and isinstance(val, str):
-                    new_val = val
-                    for old, new in replacements:
-                        new_val = new_val.replace(old, new)
+                    new_val = _replace_text(val)
                     if new_val != val:
                         setattr(props, attr, new_val)
             except Exception:
@@ -173,9 +362,7 @@ def apply_replacements_to_docx(docx_bytes: bytes, replacements: list[tuple[str,
             if 'extended-properties' in str(getattr(rel, 'reltype', '')):
                 app_part = rel.target_part
                 xml_str = app_part.blob.decode('utf-8')
-                new_xml = xml_str
-                for old, new in replacements:
-                    new_xml = new_xml.replace(old, new)
+                new_xml = _replace_text(xml_str)
                 if new_xml != xml_str:
                     app_part._blob = new_xml.encode('utf-8')
                 break
@@ -199,43 +386,15 @@ def apply_replacements_to_doc(doc_bytes: bytes, replacements: list[tuple[str, st
     Returns:
         Modified .doc as bytes
     """
-    with tempfile.NamedTemporaryFile(suffix=".doc", delete=False) as tmp:
-        tmp.write(doc_bytes)
-        tmp_doc_path = tmp.name
-
-    tmp_docx_path = tmp_doc_path + ".docx"
-    modified_docx_path = tmp_doc_path + ".modified.docx"
-    output_doc_path = tmp_doc_path + ".output.doc"
+    docx_bytes = _doc_to_docx(doc_bytes)
+    modified_docx = apply_replacements_to_docx(docx_bytes, replacements)
+    return _textutil_convert(modified_docx, "docx", "doc")
 
-    try:
-        result = subprocess.run(
-            ["textutil", "-convert", "docx", "-output", tmp_docx_path, tmp_doc_path],
-            capture_output=True, text=True, timeout=30,
-        )
-        if result.returncode != 0:
-            raise RuntimeError(f"textutil doc->docx failed: {result.stderr}")
 
-        with open(tmp_docx_path, "rb") as f:
-            docx_bytes = f.read()
-
-        modified_docx = apply_replacements_to_docx(docx_bytes, replacements)
-
-        with open(modified_docx_path, "wb") as f:
-            f.write(modified_docx)
-
-        result = subprocess.run(
-            ["textutil", "-convert", "doc", "-output", output_doc_path, modified_docx_path],
-            capture_output=True, text=True, timeout=30,
-        )
-        if result.returncode != 0:
-            raise RuntimeError(f"textutil docx->doc failed: {result.stderr}")
-
-        with open(output_doc_path, "rb") as f:
-            return f.read()
-    finally:
-        for path in [tmp_doc_path, tmp_docx_path, modified_docx_path, output_doc_path]:
-            if os.path.exists(path):
-                os.unlink(path)
+@lru_cache(maxsize=8)
+def _doc_to_docx(doc_bytes: bytes) -> bytes:
+    """Convert .doc to .docx via textutil, cached by content for re-runs."""
+    return _textutil_convert(doc_bytes, "doc", "docx")
 
 
 def build_replacement_pairs(mapping_data: dict, reverse: bool = False) -> list[tuple[str, str]]:
@@ -280,10 +439,12 @@ def save_mapping(mapping_dict: dict, filename: str) -> str:
 
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     save_filename = f"{filename}_mapping_{timestamp}.json"
-    filepath = os.path.join(MAPPINGS_DIR, save_filename)
 
-    with open(filepath, "w", encoding="utf-8") as f:
-        json.dump(mapping_dict, f, ensure_ascii=False, indent=2)
+    data = orjson.dumps(mapping_dict, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+
+    filepath = os.path.join(MAPPINGS_DIR, save_filename)
+    with open(filepath, "wb") as f:
+        f.write(data)
 
     return filepath
 
@@ -298,6 +459,4 @@ def load_mapping(uploaded_file) -> dict:
     Returns:
         Mapping dictionary
     """
-    content = uploaded_file.read()
-    text = content.decode("utf-8")
-    return json.loads(text)
+    return orjson.loads(uploaded_file.read())
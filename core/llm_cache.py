@@ -0,0 +1,160 @@
+"""
+LLM response cache — exact-match cache for chat completion responses.
+
+Responses are keyed by a SHA-256 hash of the normalized request
+(endpoint, model, messages, temperature) and stored in SQLite under
+data/llm_cache.sqlite, so re-running a scan on the same document skips
+the API round-trip entirely.
+"""
+
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import unicodedata
+
+CACHE_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)), "data", "llm_cache.sqlite"
+)
+
+# Default time-to-live for cached responses (seconds)
+DEFAULT_TTL = 7 * 24 * 3600
+
+
+def _connect() -> sqlite3.Connection:
+    """Open a connection to the cache database, creating it if needed."""
+    os.makedirs(os.path.dirname(CACHE_PATH), exist_ok=True)
+    conn = sqlite3.connect(CACHE_PATH, timeout=10)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS responses ("
+        " key TEXT PRIMARY KEY,"
+        " response TEXT NOT NULL,"
+        " created_at REAL NOT NULL,"
+        " ttl REAL NOT NULL)"
+    )
+    return conn
+
+
+def _normalize(value):
+    """Recursively NFC-normalize and strip strings inside a request payload."""
+    if isinstance(value, str):
+        return unicodedata.normalize("NFC", value).strip()
+    if isinstance(value, list):
+        return [_normalize(v) for v in value]
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in value.items()}
+    return value
+
+
+def make_key(
+    base: str,
+    model: str,
+    messages: list[dict],
+    temperature: float = None,
+    response_format: dict = None,
+) -> str:
+    """
+    Build a cache key for an LLM request.
+
+    Args:
+        base: API base URL
+        model: Model name
+        messages: Chat messages list
+        temperature: Generation temperature (None = model default)
+        response_format: Requested output format (None = free text)
+
+    Returns:
+        Hex SHA-256 digest of the normalized request
+    """
+    request = {
+        "base": base,
+        "model": model,
+        "messages": _normalize(messages),
+        "temperature": temperature,
+    }
+    if response_format is not None:
+        request["response_format"] = response_format
+    payload = json.dumps(request, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def get(key: str) -> str | None:
+    """
+    Look up a cached response.
+
+    Args:
+        key: Cache key from make_key()
+
+    Returns:
+        Cached response text, or None if missing, expired, or unreadable
+    """
+    try:
+        conn = _connect()
+        try:
+            row = conn.execute(
+                "SELECT response, created_at, ttl FROM responses WHERE key = ?",
+                (key,),
+            ).fetchone()
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return None
+
+    if row is None:
+        return None
+
+    response, created_at, ttl = row
+    if time.time() - created_at > ttl:
+        return None
+    return response
+
+
+def clear() -> int:
+    """
+    Delete all cached responses, and VACUUM so their text does not linger
+    in free pages of the database file.
+
+    Returns:
+        Number of responses removed (0 on failure)
+    """
+    try:
+        conn = _connect()
+        try:
+            with conn:
+                removed = conn.execute("DELETE FROM responses").rowcount
+            conn.execute("VACUUM")
+            return removed
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return 0
+
+
+def set(key: str, response: str, ttl: float = DEFAULT_TTL):
+    """
+    Store a response in the cache, purging expired entries.
+    Failures are ignored.
+
+    Args:
+        key: Cache key from make_key()
+        response: LLM text response
+        ttl: Time-to-live in seconds
+    """
+    try:
+        conn = _connect()
+        try:
+            now = time.time()
+            with conn:
+                # Expired rows hold document text; drop them rather than keep them forever
+                conn.execute("DELETE FROM responses WHERE created_at + ttl < ?", (now,))
+                conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, response, created_at, ttl)"
+                    " VALUES (?, ?, ?, ?)",
+                    (key, response, now, ttl),
+                )
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        pass
@@ -1,65 +1,330 @@
 """
 LLM API client — calls external LLM via OpenAI-compatible format.
-Configured through .env file (LLM_API_BASE, LLM_API_KEY, LLM_MODEL).
+Configured through .env file (LLM_API_BASE, LLM_API_KEY, LLM_MODEL,
+optional LLM_MAX_CONCURRENCY, optional numbered extra providers).
 """
 
 import os
 import re
 import json
+import time
+import threading
+from dataclasses import dataclass, field
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from dotenv import load_dotenv
+from core import llm_cache
 
 load_dotenv()
 
+_JSON_DECODER = json.JSONDecoder()
+# Object whose first key holds an array, e.g. {"items": [...]}
+_WRAPPED_ARRAY_RE = re.compile(r'\{\s*"\w+"\s*:\s*\[')
+
 LLM_API_BASE = os.getenv("LLM_API_BASE", "")
 LLM_API_KEY = os.getenv("LLM_API_KEY", "")
 LLM_MODEL = os.getenv("LLM_MODEL", "")
 
+# Upper bound on concurrent requests per provider (rate-limit guard)
+DEFAULT_MAX_CONCURRENCY = 8
+
+# Extra providers: LLM_API_BASE_1 / LLM_API_KEY_1 / LLM_MODEL_1, ...
+_NUMBERED_BASE_RE = re.compile(r"LLM_API_BASE_(\d+)")
+
+
+def _read_max_concurrency(name: str = "LLM_MAX_CONCURRENCY") -> int:
+    """Read a concurrency limit from the environment (at least 1)."""
+    try:
+        return max(1, int(os.getenv(name, DEFAULT_MAX_CONCURRENCY)))
+    except ValueError:
+        return DEFAULT_MAX_CONCURRENCY
+
+
+@dataclass(eq=False)
+class Provider:
+    """One OpenAI-compatible endpoint with its own concurrency limit."""
+
+    base: str
+    key: str
+    model: str
+    max_concurrency: int = DEFAULT_MAX_CONCURRENCY
+    # Cleared when the provider rejects response_format; reset by reload_config()
+    json_mode: bool = field(default=True, init=False)
+    slots: threading.BoundedSemaphore = field(init=False, repr=False)
+
+    def __post_init__(self):
+        self.slots = threading.BoundedSemaphore(self.max_concurrency)
+
+
+def _load_providers() -> list[Provider]:
+    """
+    Build the provider list: the primary provider (LLM_API_BASE / LLM_API_KEY /
+    LLM_MODEL / LLM_MAX_CONCURRENCY) followed by any numbered providers
+    (LLM_API_BASE_i / LLM_API_KEY_i, optional LLM_MODEL_i defaulting to
+    LLM_MODEL, optional LLM_MAX_CONCURRENCY_i).
+    """
+    providers = [
+        Provider(LLM_API_BASE, LLM_API_KEY, LLM_MODEL, _read_max_concurrency())
+    ]
+
+    numbers = sorted(
+        int(m.group(1))
+        for m in (_NUMBERED_BASE_RE.fullmatch(name) for name in os.environ)
+        if m
+    )
+    for i in numbers:
+        base = os.getenv(f"LLM_API_BASE_{i}", "")
+        key = os.getenv(f"LLM_API_KEY_{i}", "")
+        if not base or not key:
+            continue
+        providers.append(Provider(
+            base,
+            key,
+            os.getenv(f"LLM_MODEL_{i}", "") or LLM_MODEL,
+            _read_max_concurrency(f"LLM_MAX_CONCURRENCY_{i}"),
+        ))
+    return providers
+
+
+PROVIDERS = _load_providers()
+
+# Shared HTTP session: keeps TLS connections alive across calls
+# (urllib3 pools connections per host, so one session serves all providers)
+HTTP_POOL_SIZE = 32
+_session: requests.Session | None = None
+_session_lock = threading.Lock()
+
+# Seconds a connection probe result is reused by check_api_connection_cached()
+CONNECTION_CHECK_TTL = 30
+_connection_checks = {}
+_connection_checks_lock = threading.Lock()
+
 
 def reload_config():
     """Reload LLM config from .env file. Called after settings change."""
-    global LLM_API_BASE, LLM_API_KEY, LLM_MODEL
+    global LLM_API_BASE, LLM_API_KEY, LLM_MODEL, PROVIDERS
     load_dotenv(override=True)
     LLM_API_BASE = os.getenv("LLM_API_BASE", "")
     LLM_API_KEY = os.getenv("LLM_API_KEY", "")
     LLM_MODEL = os.getenv("LLM_MODEL", "")
 
+    # In-flight calls keep their old Provider (and semaphore); new calls use these
+    PROVIDERS = _load_providers()
+
+    _close_session()
+    _clear_connection_checks()
 
-def call_llm(messages: list[dict], temperature: float = None) -> str:
+
+def _get_session() -> requests.Session:
+    """
+    Return the shared HTTP session, creating it on first use.
+
+    The session pools connections (so repeated calls skip the TCP/TLS
+    handshake) and retries 429/5xx responses with exponential backoff,
+    honouring Retry-After. Read timeouts are not retried.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            retry = Retry(
+                total=3,
+                # Never resend a POST whose completion may already be running
+                # (and billed); only the status-code retries below apply
+                read=0,
+                other=0,
+                backoff_factor=0.5,
+                status_forcelist=[429, 500, 502, 503, 504],
+                allowed_methods=None,  # chat completions are POST
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(
+                pool_connections=HTTP_POOL_SIZE,
+                pool_maxsize=max(HTTP_POOL_SIZE, *(p.max_concurrency for p in PROVIDERS)),
+                max_retries=retry,
+            )
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
+
+
+def _close_session():
+    """Close the shared HTTP session; the next call builds a fresh one."""
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+def _open_connection(base: str):
+    """Send a HEAD request to base so the session pools a live connection."""
+    try:
+        _get_session().head(base, timeout=10)
+    except requests.RequestException:
+        pass
+
+
+def warm_up():
+    """
+    Open a pooled connection to each configured provider in the background,
+    so the first real call skips the TCP/TLS handshake. Returns immediately.
+    """
+    for base in dict.fromkeys(p.base for p in PROVIDERS if p.base):
+        threading.Thread(target=_open_connection, args=(base,), daemon=True).start()
+
+
+def get_providers() -> list[Provider]:
+    """
+    Configured providers, primary first. Work that fans out across many
+    calls (e.g. Pass 2) can spread them over all providers.
+
+    Returns:
+        List of Provider (always at least the primary)
+    """
+    return PROVIDERS
+
+
+def get_max_concurrency() -> int:
+    """
+    Maximum number of requests allowed in flight at once on the primary provider.
+
+    Returns:
+        Configured LLM_MAX_CONCURRENCY (default 8)
+    """
+    return PROVIDERS[0].max_concurrency
+
+
+def supports_prompt_caching(provider: Provider = None) -> bool:
+    """
+    Whether a provider accepts cache_control breakpoints on message
+    content parts (Anthropic / Claude models).
+
+    Args:
+        provider: Provider to check (None = primary)
+
+    Returns:
+        True if prompt prefixes can be explicitly marked as cacheable
+    """
+    provider = provider or PROVIDERS[0]
+    target = f"{provider.base} {provider.model}".lower()
+    return "anthropic" in target or "claude" in target
+
+
+def _post_chat(provider: Provider, body: dict) -> requests.Response:
+    """POST a chat completion request to a provider through the shared session."""
+    with provider.slots:
+        return _get_session().post(
+            f"{provider.base}/chat/completions",
+            headers={
+                "Authorization": f"Bearer {provider.key}",
+                "Content-Type": "application/json",
+            },
+            data=orjson.dumps(body),
+            timeout=120,
+        )
+
+
+def _rejects_response_format(response: requests.Response) -> bool:
+    """
+    Whether a response is a 400 complaining about response_format / JSON mode,
+    as opposed to other bad requests (context length, unknown model, ...).
+    """
+    if response.status_code != 400:
+        return False
+    error_text = response.text.lower()
+    return "response_format" in error_text or "json_object" in error_text
+
+
+def call_llm(
+    messages: list[dict],
+    temperature: float = None,
+    bypass_cache: bool = False,
+    response_format: dict = None,
+    provider: Provider = None,
+    validate=None,
+) -> str:
     """
     Call the LLM API and return the text response.
+    Responses are served from / stored in the local LLM cache unless bypassed.
+    With a validator, only responses it accepts are cached, and a cached
+    response it rejects is fetched again.
 
     Args:
         messages: Chat messages list [{"role": "...", "content": "..."}, ...]
         temperature: Generation temperature (None = model default).
                      Some models (e.g. kimi-k2.5) only allow default temperature.
+        bypass_cache: If True, always call the API and do not store the response
+        response_format: Optional output constraint, e.g. {"type": "json_object"}.
+                         Dropped (for this and later calls) if the provider rejects it
+                         with a 400 that names response_format / json_object.
+        provider: Provider to send the request to (None = primary)
+        validate: Optional function called with the response text; raising
+                  marks the response as unusable (e.g. parse_json_response)
 
     Returns:
         LLM text response
+
+    Raises:
+        Whatever validate raises for a freshly fetched response
     """
-    if not LLM_API_BASE or not LLM_API_KEY or not LLM_MODEL:
+    provider = provider or PROVIDERS[0]
+
+    if not provider.base or not provider.key or not provider.model:
         raise ValueError(
             "LLM API config incomplete. Check LLM_API_BASE, LLM_API_KEY, LLM_MODEL in .env"
         )
 
+    if not provider.json_mode:
+        response_format = None
+
+    cache_key = None
+    if not bypass_cache:
+        cache_key = llm_cache.make_key(
+            provider.base, provider.model, messages, temperature, response_format
+        )
+        cached = llm_cache.get(cache_key)
+        if cached is not None:
+            try:
+                if validate is not None:
+                    validate(cached)
+                return cached
+            except Exception:
+                print("Cached LLM response is unusable, calling the API again")
+
     body = {
-        "model": LLM_MODEL,
+        "model": provider.model,
         "messages": messages,
     }
     if temperature is not None:
         body["temperature"] = temperature
+    if response_format is not None:
+        body["response_format"] = response_format
+
+    response = _post_chat(provider, body)
+    if response_format is not None and _rejects_response_format(response):
+        # Provider does not support JSON mode: retry without it, and stop sending it
+        print("Provider rejected response_format, retrying without it")
+        provider.json_mode = False
+        del body["response_format"]
+        response = _post_chat(provider, body)
+        if cache_key is not None:
+            cache_key = llm_cache.make_key(
+                provider.base, provider.model, messages, temperature
+            )
 
-    response = requests.post(
-        f"{LLM_API_BASE}/chat/completions",
-        headers={
-            "Authorization": f"Bearer {LLM_API_KEY}",
-            "Content-Type": "application/json",
-        },
-        json=body,
-        timeout=120,
-    )
     response.raise_for_status()
-    return response.json()["choices"][0]["message"]["content"]
+    content = orjson.loads(response.content)["choices"][0]["message"]["content"]
+
+    if validate is not None:
+        validate(content)
+    if cache_key is not None:
+        llm_cache.set(cache_key, content)
+
+    return content
 
 
 def check_api_connection() -> bool:
@@ -72,48 +337,160 @@ def check_api_connection() -> bool:
     try:
         result = call_llm(
             [{"role": "user", "content": "Reply OK"}],
+            bypass_cache=True,
         )
         return len(result) > 0
     except Exception:
         return False
 
 
-def parse_json_response(text: str) -> dict | list:
+def check_api_connection_cached(model: str, endpoint: str) -> bool:
+    """
+    check_api_connection() memoized per (model, endpoint) for
+    CONNECTION_CHECK_TTL seconds, so page loads don't each re-probe the API.
+    Call check_api_connection_cached.clear() to force a fresh probe.
+
+    Args:
+        model: Configured model name (cache key only)
+        endpoint: Configured API base URL (cache key only)
+
+    Returns:
+        True if connected, False otherwise
+    """
+    key = (model, endpoint)
+    with _connection_checks_lock:
+        hit = _connection_checks.get(key)
+    if hit is not None and time.monotonic() - hit[1] < CONNECTION_CHECK_TTL:
+        return hit[0]
+
+    connected = check_api_connection()
+    with _connection_checks_lock:
+        _connection_checks[key] = (connected, time.monotonic())
+    return connected
+
+
+def _clear_connection_checks():
+    """Forget all memoized connection probe results."""
+    with _connection_checks_lock:
+        _connection_checks.clear()
+
+
+check_api_connection_cached.clear = _clear_connection_checks
+
+
+def _first_bracket(text: str, pos: int = 0) -> int:
+    """Index of the first "{" or "[" at or after pos, or -1 if there is none."""
+    brace = text.find("{", pos)
+    bracket = text.find("[", pos)
+    if brace == -1 or (bracket != -1 and bracket < brace):
+        return bracket
+    return brace
+
+
+def _salvage_array(text: str) -> list | None:
+    """
+    Recover the complete leading items of a truncated JSON array
+    (e.g. a response cut off by max tokens), either bare or wrapped
+    as the first key of an object ({"items": [...]}).
+
+    Args:
+        text: Raw LLM response text
+
+    Returns:
+        List of the items decoded before the truncation point,
+        or None if the response is not an array or has no complete item
+    """
+    start = _first_bracket(text)
+    if start != -1 and text[start] == "{":
+        wrapper = _WRAPPED_ARRAY_RE.match(text, start)
+        start = wrapper.end() - 1 if wrapper else -1
+    if start == -1:
+        return None
+
+    items = []
+    pos = start + 1
+    end = len(text)
+    while True:
+        while pos < end and text[pos] in " \t\r\n,":
+            pos += 1
+        if pos >= end or text[pos] == "]":
+            break
+        try:
+            item, pos = _JSON_DECODER.raw_decode(text, pos)
+        except json.JSONDecodeError:
+            break
+        items.append(item)
+
+    return items or None
+
+
+def _is_result_shape(data) -> bool:
+    """Whether decoded JSON looks like an LLM result: an object or an array of objects."""
+    if isinstance(data, dict):
+        return True
+    return isinstance(data, list) and all(isinstance(item, dict) for item in data)
+
+
+def parse_json_response(text: str, allow_partial: bool = False) -> dict | list:
     """
     Extract JSON data from an LLM response.
 
-    Handles various formats: raw JSON, markdown-wrapped JSON,
-    JSON embedded in explanatory text.
+    Only an object or an array of objects counts as a result. Pure JSON
+    responses (the norm in JSON mode) are parsed with orjson. Otherwise each
+    "{" / "[" is tried in turn with raw_decode, so markdown-wrapped JSON and
+    JSON after bracketed prose ("[see below]", "[1]") are found; a candidate
+    that fails or has another shape moves the scan past it. Then falls back
+    to the text between the first "{" and last "}" (or "[" and "]"), and, if
+    allow_partial, to the complete leading items of a truncated array.
 
     Args:
         text: Raw LLM response text
+        allow_partial: If True, accept the salvaged prefix of a truncated
+                       array. Only for callers that detect and redo the
+                       items that are missing.
 
     Returns:
         Parsed dict or list
-    """
-    try:
-        return json.loads(text.strip())
-    except json.JSONDecodeError:
-        pass
 
-    cleaned = re.sub(r"```(?:json)?\s*", "", text)
-    cleaned = cleaned.strip()
+    Raises:
+        ValueError: If no complete JSON value is found (including a truncated
+                    array when allow_partial is False)
+    """
     try:
-        return json.loads(cleaned)
-    except json.JSONDecodeError:
+        data = orjson.loads(text)
+        if _is_result_shape(data):
+            return data
+    except orjson.JSONDecodeError:
         pass
 
-    for start_char, end_char in [("{", "}"), ("[", "]")]:
-        start_idx = text.find(start_char)
-        if start_idx == -1:
+    start = _first_bracket(text)
+    while start != -1:
+        try:
+            data, end = _JSON_DECODER.raw_decode(text, start)
+        except json.JSONDecodeError as e:
+            # Everything up to the error was valid JSON; brackets in it are nested
+            start = _first_bracket(text, max(e.pos, start + 1))
             continue
-        end_idx = text.rfind(end_char)
-        if end_idx == -1 or end_idx <= start_idx:
+        if _is_result_shape(data):
+            return data
+        start = _first_bracket(text, end)
+
+    for open_char, close_char in (("{", "}"), ("[", "]")):
+        start = text.find(open_char)
+        end = text.rfind(close_char)
+        if start == -1 or end <= start:
             continue
-        json_str = text[start_idx : end_idx + 1]
         try:
-            return json.loads(json_str)
+            data = json.loads(text[start : end + 1])
         except json.JSONDecodeError:
             continue
+        if _is_result_shape(data):
+            return data
+
+    if allow_partial:
+        items = _salvage_array(text)
+        if items is not None and _is_result_shape(items):
+            print(f"Recovered {len(items)} items from truncated JSON array")
+            return items
 
     raise ValueError(f"Failed to parse JSON from LLM response:\n{text[:500]}")
@@ -0,0 +1,198 @@
+"""
+Multi-pattern string matcher — finds many literal strings in one pass over a text
+and splices replacements back in with a single join.
+
+Uses an Aho–Corasick automaton (pyahocorasick) when available, otherwise
+falls back to one str.find scan per word.
+
+Overlaps are resolved the same way as replacing strings one at a time,
+longest first: a longer string always wins over a shorter one it overlaps.
+"""
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+
+def build_matcher(words):
+    """
+    Build a matcher for a collection of literal strings.
+
+    Args:
+        words: Iterable of strings to search for (empty strings are ignored).
+               Longer strings take priority; equal lengths keep input order.
+
+    Returns:
+        Opaque matcher object for find_matches(), or None if there are no words
+    """
+    ranked = sorted(dict.fromkeys(w for w in words if w), key=len, reverse=True)
+    if not ranked:
+        return None
+
+    if ahocorasick is not None:
+        automaton = ahocorasick.Automaton()
+        for rank, word in enumerate(ranked):
+            automaton.add_word(word, (len(word) - 1, rank, word))
+        automaton.make_automaton()
+        return automaton
+
+    return ranked
+
+
+def _collect_candidates(matcher, text: str) -> list[tuple[int, int, int, str]]:
+    """Return (start, end, rank, word) for every candidate match in text."""
+    if ahocorasick is not None:
+        return [
+            (last - back, last + 1, rank, word)
+            for last, (back, rank, word) in matcher.iter(text)
+        ]
+
+    candidates = []
+    for rank, word in enumerate(matcher):
+        start = text.find(word)
+        while start != -1:
+            candidates.append((start, start + len(word), rank, word))
+            start = text.find(word, start + 1)
+    return candidates
+
+
+def _resolve_cluster(cluster: list, matches: list):
+    """
+    Pick non-overlapping matches from a group of mutually overlapping
+    candidates: best rank (longest word) first, then leftmost.
+    """
+    base = cluster[0][0]
+    taken = bytearray(max(end for _, end, _, _ in cluster) - base)
+
+    # Cluster is sorted by start, and sort() is stable, so equal ranks stay leftmost-first
+    cluster.sort(key=lambda c: c[2])
+    for start, end, _, word in cluster:
+        if taken.find(1, start - base, end - base) != -1:
+            continue
+        taken[start - base : end - base] = b"\x01" * (end - start)
+        matches.append((start, end, word))
+
+
+def find_matches(matcher, text: str) -> list[tuple[int, int, str]]:
+    """
+    Find non-overlapping occurrences of the matcher's words in text.
+
+    Args:
+        matcher: Object returned by build_matcher()
+        text: Text to scan
+
+    Returns:
+        List of (start, end, word) tuples sorted by start
+    """
+    if matcher is None or not text:
+        return []
+
+    candidates = _collect_candidates(matcher, text)
+    candidates.sort()
+
+    # Most candidates overlap nothing and are accepted as-is; only runs of
+    # overlapping candidates need the longest-first resolution.
+    matches = []
+    append = matches.append
+    cluster = []
+    cluster_end = -1
+
+    for candidate in candidates:
+        start, end = candidate[0], candidate[1]
+        if start >= cluster_end:
+            if len(cluster) == 1:
+                single = cluster[0]
+                append((single[0], single[1], single[3]))
+            elif cluster:
+                _resolve_cluster(cluster, matches)
+            cluster = [candidate]
+            cluster_end = end
+        else:
+            cluster.append(candidate)
+            if end > cluster_end:
+                cluster_end = end
+
+    if len(cluster) == 1:
+        single = cluster[0]
+        append((single[0], single[1], single[3]))
+    elif cluster:
+        _resolve_cluster(cluster, matches)
+
+    matches.sort()
+    return matches
+
+
+def apply_edits(text: str, edits: list[tuple[int, int, str]]) -> str:
+    """
+    Replace text[start:end] with new text for each edit, in a single join.
+
+    Args:
+        text: Original text
+        edits: Non-overlapping (start, end, replacement) tuples sorted by start
+
+    Returns:
+        Edited text
+    """
+    parts = []
+    append = parts.append
+    cursor = 0
+    for start, end, replacement in edits:
+        append(text[cursor:start])
+        append(replacement)
+        cursor = end
+    append(text[cursor:])
+    return "".join(parts)
+
+
+def replace_all(matcher, text: str, replacements: dict) -> str:
+    """
+    Replace every match of the matcher's words with replacements[word].
+
+    Args:
+        matcher: Object returned by build_matcher(replacements)
+        text: Text to edit
+        replacements: Mapping of word -> replacement text
+
+    Returns:
+        Edited text (the same object if nothing matched)
+    """
+    matches = find_matches(matcher, text)
+    if not matches:
+        return text
+    return apply_edits(
+        text, [(start, end, replacements[word]) for start, end, word in matches]
+    )
+
+
+def count_occurrences(words, text: str) -> dict[str, int]:
+    """
+    Count occurrences of each word in text in a single pass.
+    Counts match str.count() per word: non-overlapping for the same word,
+    independent across words.
+
+    Args:
+        words: Iterable of strings to count
+        text: Text to scan
+
+    Returns:
+        Mapping of word -> occurrence count
+    """
+    counts = dict.fromkeys(words, 0)
+    matcher = build_matcher(counts)
+
+    if matcher is not None and text:
+        if ahocorasick is not None:
+            # Matches arrive ordered by end; a word's next hit must start past its last one
+            next_free = {}
+            for last, (back, _, word) in matcher.iter(text):
+                if last - back >= next_free.get(word, 0):
+                    counts[word] += 1
+                    next_free[word] = last + 1
+        else:
+            for word in matcher:
+                counts[word] = text.count(word)
+
+    if "" in counts:
+        counts[""] = text.count("")
+    return counts
@@ -1,9 +1,11 @@
 """
 Prompt templates for the LLM.
 
-Contains two prompts:
+Contains:
 - PASS1_PROMPT: Extract entity definitions and aliases from key sections
-- PASS2_PROMPT: Identify all sensitive items in each document segment
+- PASS2_PROMPT_PREFIX: Shared Pass 2 instructions (filled with alias context once per scan)
+- PASS2_SINGLE_FORMAT / PASS2_BATCH_FORMAT: Output format for one segment or several
+  <<<SEG i>>>-delimited segments; a Pass 2 prompt is prefix + format + segment text
 
 Note: Prompt content is in Chinese to instruct the LLM for Chinese legal documents.
 """
@@ -44,8 +46,21 @@ PASS1_PROMPT = """你是一个法律文档分析助手。以下是一份法律
 
 # ============================================================
 # Pass 2 prompt: identify all sensitive items per document segment
+#
+# Built as PASS2_PROMPT_PREFIX + PASS2_SINGLE_FORMAT (or PASS2_BATCH_FORMAT)
+# + segment text. The prefix is formatted once per scan and is identical
+# across all Pass 2 calls. The format blocks are plain strings (not
+# .format templates), so their JSON braces are not doubled.
+#
+# Responses are JSON objects ({"items": [...]} / {"segments": [...]}) so the
+# calls can request response_format json_object, which requires an object.
+#
+# Keep the prefix first and free of per-call content (timestamps, segment
+# numbers, etc.): providers reuse their KV cache for byte-identical prompt
+# prefixes, and on Anthropic models the prefix is sent as a cache_control
+# content part.
 # ============================================================
-PASS2_PROMPT = """你是一个法律文档脱敏助手。请仔细阅读以下法律文档片段，识别其中所有的敏感信息。
+PASS2_PROMPT_PREFIX = """你是一个法律文档脱敏助手。请仔细阅读以下法律文档片段，识别其中所有的敏感信息。
 
 【已知实体定义（来自合同定义条款）】
 {entity_aliases_context}
@@ -65,15 +80,46 @@ PASS2_PROMPT = """你是一个法律文档脱敏助手。请仔细阅读以下
 - 公司注册号（包括统一社会信用代码、开曼/BVI注册号）
 - 具体日期（合同签署日、截止日等，不包括法律生效日等通用日期）
 
-请以 JSON 数组格式返回，不要返回任何其他内容（不要加 ```json 标记）：
-[
-  {{
-    "text": "原文中的敏感信息（保持原文形式）",
-    "type": "person/company/amount/phone/email/id/bank/wallet/address/regnum/date",
-    "canonical": "如果是已知实体的别名则填正式名称，否则留空字符串"
-  }}
-]
+"""
+
+PASS2_SINGLE_FORMAT = """请以 JSON 对象格式返回，"items" 为敏感信息数组，不要返回任何其他内容（不要加 ```json 标记）：
+{
+  "items": [
+    {
+      "text": "原文中的敏感信息（保持原文形式）",
+      "type": "person/company/amount/phone/email/id/bank/wallet/address/regnum/date",
+      "canonical": "如果是已知实体的别名则填正式名称，否则留空字符串"
+    }
+  ]
+}
+
+---
+文档片段：
+"""
+
+PASS2_BATCH_FORMAT = """以下有多个文档片段，每个片段以 <<<SEG i>>> 开始、以 <<<END>>> 结束（i 为片段编号）。
+请返回一个 JSON 对象，"segments" 数组中每个片段对应一个对象：
+"segment" 为片段编号，"items" 为该片段中的敏感信息；某个片段没有敏感信息时 "items" 返回空数组 []，但仍需包含该片段。
+不要返回任何其他内容（不要加 ```json 标记）：
+{
+  "segments": [
+    {
+      "segment": 1,
+      "items": [
+        {
+          "text": "原文中的敏感信息（保持原文形式）",
+          "type": "person/company/amount/phone/email/id/bank/wallet/address/regnum/date",
+          "canonical": "如果是已知实体的别名则填正式名称，否则留空字符串"
+        }
+      ]
+    },
+    {
+      "segment": 2,
+      "items": []
+    }
+  ]
+}
 
 ---
 文档片段：
-{document_segment}"""
+"""
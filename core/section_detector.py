@@ -7,6 +7,10 @@ Legal contracts concentrate sensitive information in three predictable sections:
 3. Signature page: signatory names, titles
 """
 
+import re
+import math
+from itertools import chain
+
 # Keywords for detecting key sections (Chinese + English)
 KEYWORDS = [
     # Definition clause (Chinese)
@@ -23,6 +27,18 @@ KEYWORDS = [
     "SIGNATURE", "IN WITNESS WHEREOF", "Executed", "By:", "Name:", "Title:",
 ]
 
+# All keywords in one alternation, longest first, compiled once; the regex
+# engine steps through each paragraph in C instead of one `in` per keyword
+_KW_RE = re.compile("|".join(sorted(map(re.escape, KEYWORDS), key=len, reverse=True)))
+
+# Line break plus surrounding non-newline whitespace: splitting the stripped
+# text on it yields stripped paragraphs (and empty strings for blank lines)
+_PARA_RE = re.compile(r"[^\S\n]*\n[^\S\n]*")
+
+# Fallback extraction budgets (characters) for the document head and tail
+FALLBACK_FRONT_CHARS = 5000
+FALLBACK_BACK_CHARS = 3000
+
 
 def detect_key_sections(text: str) -> str:
     """
@@ -31,7 +47,8 @@ def detect_key_sections(text: str) -> str:
     Logic:
     1. Scan paragraphs for keyword matches
     2. For each match, extract the paragraph plus 2 paragraphs before/after as context
-    3. If fewer than 3 keywords match, fall back to extracting first 15% + last 10%
+    3. If fewer than max(3, log2(paragraph count)) paragraphs match, fall back
+       to extracting the first ~5000 + last ~3000 characters
 
     Args:
         text: Full document text
@@ -39,53 +56,77 @@ def detect_key_sections(text: str) -> str:
     Returns:
         Concatenated key section text
     """
-    paragraphs = [p.strip() for p in text.split("\n") if p.strip()]
+    paragraphs = [p for p in _PARA_RE.split(text.strip()) if p]
 
     if not paragraphs:
         return text
 
-    # Find paragraphs containing keywords
-    matched_indices = set()
-    for i, paragraph in enumerate(paragraphs):
-        for keyword in KEYWORDS:
-            if keyword in paragraph:
-                matched_indices.add(i)
-                break
+    # Find paragraphs containing keywords (in ascending order by construction)
+    matched_indices = [
+        i for i, paragraph in enumerate(paragraphs) if _KW_RE.search(paragraph)
+    ]
 
-    # Fall back if too few matches
-    if len(matched_indices) < 3:
-        return _fallback_extraction(text)
+    # Fall back if too few matches; longer documents need a few more
+    threshold = max(3, int(math.log2(max(2, len(paragraphs)))))
+    if len(matched_indices) < threshold:
+        return _fallback_extraction(paragraphs)
 
-    # Expand each match with +/- 2 paragraphs of context
-    selected_indices = set()
+    # Expand each match with +/- 2 paragraphs of context, merging
+    # overlapping or adjacent windows into (lo, hi) ranges
+    last = len(paragraphs) - 1
+    merged = []
     for idx in matched_indices:
-        for offset in range(-2, 3):
-            target = idx + offset
-            if 0 <= target < len(paragraphs):
-                selected_indices.add(target)
-
-    selected_paragraphs = [
-        paragraphs[i] for i in sorted(selected_indices)
-    ]
+        lo, hi = max(0, idx - 2), min(last, idx + 2)
+        if merged and lo <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], hi)
+        else:
+            merged.append((lo, hi))
 
-    return "\n\n".join(selected_paragraphs)
+    return "\n\n".join(
+        chain.from_iterable(paragraphs[lo : hi + 1] for lo, hi in merged)
+    )
 
 
-def _fallback_extraction(text: str) -> str:
+def _fallback_extraction(paragraphs: list[str]) -> str:
     """
-    Fallback: extract first 15% + last 10% of the document.
+    Fallback: extract whole paragraphs from the start of the document up to
+    FALLBACK_FRONT_CHARS and from the end up to FALLBACK_BACK_CHARS, so the
+    Pass 1 prompt stays bounded however long the document is.
 
     Args:
-        text: Full document text
+        paragraphs: Non-empty stripped paragraphs of the document
 
     Returns:
-        Front and back portions concatenated
+        Front and back paragraphs concatenated (the whole text if it fits)
     """
-    total_len = len(text)
-    front_end = int(total_len * 0.15)
-    back_start = int(total_len * 0.90)
+    text = "\n\n".join(paragraphs)
+    if len(text) <= FALLBACK_FRONT_CHARS + FALLBACK_BACK_CHARS:
+        return text
 
-    front_part = text[:front_end]
-    back_part = text[back_start:]
+    front_part = "\n\n".join(_take_paragraphs(paragraphs, FALLBACK_FRONT_CHARS))
+    back_part = "\n\n".join(
+        _take_paragraphs(paragraphs, FALLBACK_BACK_CHARS, from_end=True)
+    )
 
     return front_part + "\n\n...\n\n" + back_part
+
+
+def _take_paragraphs(
+    paragraphs: list[str], budget: int, from_end: bool = False
+) -> list[str]:
+    """
+    Take whole paragraphs from the start (or end) of the document while
+    their joined length fits in budget. An oversized first (or last)
+    paragraph is cut to the budget rather than skipped.
+    """
+    taken = []
+    used = 0
+    for paragraph in reversed(paragraphs) if from_end else paragraphs:
+        used += len(paragraph) + (2 if taken else 0)
+        if used > budget:
+            break
+        taken.append(paragraph)
+
+    if not taken:
+        taken.append(paragraphs[-1][-budget:] if from_end else paragraphs[0][:budget])
+    return taken[::-1] if from_end else taken
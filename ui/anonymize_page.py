@@ -11,10 +11,11 @@ Output filenames are generic (no original identifying info).
 """
 
 import json
+import hashlib
 from datetime import datetime
 import streamlit as st
-import pandas as pd
-from core.anonymizer import run_first_pass, run_second_pass, execute_replacement
+from core.anonymizer import run_first_pass, iter_second_pass, execute_replacement
+from core.llm_client import warm_up
 from core.file_handler import (
     read_uploaded_file,
     get_uploaded_bytes,
@@ -23,10 +24,210 @@ from core.file_handler import (
     apply_replacements_to_doc,
     build_replacement_pairs,
 )
+from core.matcher import count_occurrences
+
+
+# The cache is shared by all sessions; keep only a few documents in memory
+@st.cache_data(show_spinner=False, max_entries=4)
+def _build_entity_table(entity_snapshot: tuple, text: str) -> "pd.DataFrame":
+    """
+    Build the Step 3 entity table, cached across reruns.
+
+    Args:
+        entity_snapshot: Tuple of (text, type, canonical) per Pass 2 entity
+        text: Full document text (for occurrence counts)
+
+    Returns:
+        DataFrame with Text / Type / Canonical Name / Occurrences columns
+    """
+    import pandas as pd
+
+    # Count all entity texts in one pass over the document
+    counts = count_occurrences((entity_text for entity_text, _, _ in entity_snapshot), text)
+
+    return pd.DataFrame([
+        {
+            "Text": entity_text,
+            "Type": entity_type,
+            "Canonical Name": canonical,
+            "Occurrences": counts[entity_text],
+        }
+        for entity_text, entity_type, canonical in entity_snapshot
+    ])
+
+
+def _drive_second_pass(scan, progress_bar, found_slot) -> list[dict]:
+    """
+    Run iter_second_pass() to completion, updating the progress bar and a
+    table of items found so far as each batch of segments completes.
+
+    Args:
+        scan: Generator returned by iter_second_pass()
+        progress_bar: st.progress element
+        found_slot: st.empty() placeholder for the running table
+
+    Returns:
+        iter_second_pass()'s return value: (entities, complete)
+    """
+    import pandas as pd
+
+    found = {}
+    while True:
+        try:
+            current, total, entities = next(scan)
+        except StopIteration as stop:
+            return stop.value
+
+        for entity in entities:
+            if entity.get("text", "").strip():
+                found.setdefault((entity.get("text", ""), entity.get("type", "")), entity)
+
+        progress_bar.progress(
+            current / total,
+            text=f"Scanning segment {current}/{total}...",
+        )
+        found_slot.dataframe(pd.DataFrame(
+            [{"Text": text, "Type": entity_type} for text, entity_type in found],
+            columns=["Text", "Type"],
+        ))
+
+
+def _scan_pass1(force: bool = False):
+    """
+    Run Pass 1 on the uploaded document and rerun the page with its result.
+
+    Args:
+        force: If True, ignore cached results and LLM responses
+    """
+    with st.spinner("Scanning key sections for entity definitions..."):
+        try:
+            result = run_first_pass(st.session_state.uploaded_text, force=force)
+        except Exception as e:
+            st.error(f"Pass 1 scan failed: {e}")
+            return
+    st.session_state.pass1_result = result
+    # Drop edits made to the previous result's table
+    st.session_state.pop("alias_editor", None)
+    st.rerun()
+
+
+def _scan_pass2(force: bool = False):
+    """
+    Run Pass 2 on the uploaded document with live progress, and rerun the
+    page with its result.
+
+    Args:
+        force: If True, ignore cached results and LLM responses
+    """
+    progress_bar = st.progress(0, text="Scanning document segments...")
+    found_slot = st.empty()
+
+    try:
+        result, complete = _drive_second_pass(
+            iter_second_pass(
+                st.session_state.uploaded_text,
+                st.session_state.pass1_result,
+                force=force,
+            ),
+            progress_bar,
+            found_slot,
+        )
+    except Exception as e:
+        st.error(f"Pass 2 scan failed: {e}")
+        return
+    st.session_state.pass2_result = result
+    st.session_state.pass2_complete = complete
+    st.session_state.pop("entity_editor", None)
+    progress_bar.progress(1.0, text="Scan complete!")
+    st.rerun()
+
+
+def _clean_column(df, column: str):
+    """A data_editor column as stripped strings, with missing cells as ""."""
+    return df[column].fillna("").astype(str).str.strip()
+
+
+def _aliases_from_editor(df) -> list[dict]:
+    """
+    Convert the edited entity definition table back to Pass 1 alias groups.
+    Rows without a canonical name are dropped.
+
+    Args:
+        df: DataFrame from the alias data_editor
+
+    Returns:
+        List of {"canonical", "type", "aliases"} dicts
+    """
+    canonical = _clean_column(df, "Canonical Name")
+    keep = canonical != ""
+    aliases = df["Aliases"].fillna("").astype(str).str.split(",")
+
+    return [
+        {
+            "canonical": name,
+            "type": entity_type,
+            "aliases": [a.strip() for a in parts if a.strip()],
+        }
+        for name, entity_type, parts in zip(
+            canonical[keep], _clean_column(df, "Type")[keep], aliases[keep]
+        )
+    ]
+
+
+def _entities_from_editor(df) -> list[dict]:
+    """
+    Convert the edited sensitive item table back to Pass 2 entities.
+    Rows without text are dropped.
+
+    Args:
+        df: DataFrame from the entity data_editor
+
+    Returns:
+        List of {"text", "type", "canonical"} dicts
+    """
+    entities = df.assign(
+        text=_clean_column(df, "Text"),
+        type=_clean_column(df, "Type"),
+        canonical=_clean_column(df, "Canonical Name"),
+    )
+    entities = entities[entities["text"] != ""]
+    return entities[["text", "type", "canonical"]].to_dict("records")
+
+
+def _prepare_downloads(anonymized_text: str, mapping: dict, pass1_result: dict) -> dict:
+    """
+    Encode the download payloads and save the mapping once per anonymization,
+    so Streamlit reruns reuse them instead of re-encoding (and re-saving).
+
+    Args:
+        anonymized_text: Anonymized document text
+        mapping: Mapping table from execute_replacement()
+        pass1_result: Pass 1 results (for the document type)
+
+    Returns:
+        Dict with anon_text_bytes, mapping_json_bytes, doc_type_slug,
+        timestamp, and save_path (None if saving failed)
+    """
+    doc_type = pass1_result.get("document_type", "Document")
+
+    try:
+        save_path = save_mapping(mapping, "anonymized")
+    except Exception:
+        save_path = None
+
+    return {
+        "anon_text_bytes": anonymized_text.encode("utf-8"),
+        "mapping_json_bytes": json.dumps(mapping, ensure_ascii=False, indent=2).encode("utf-8"),
+        "doc_type_slug": doc_type.upper().replace(" ", "_"),
+        "timestamp": datetime.now().strftime("%Y%m%d_%H%M%S"),
+        "save_path": save_path,
+    }
 
 
 def render():
     """Render the anonymize page."""
+    # pandas is only needed once this page is shown; keep it off app startup
+    import pandas as pd
 
     st.header("Document Anonymization")
 
@@ -34,15 +235,19 @@ def render():
     for key, default in [
         ("uploaded_text", None),
         ("uploaded_filename", None),
+        ("upload_sig", None),
+        ("preview_text", None),
         ("uploaded_bytes", None),
         ("uploaded_ext", None),
         ("pass1_result", None),
         ("pass1_confirmed", False),
         ("pass2_result", None),
+        ("pass2_complete", True),
         ("pass2_confirmed", False),
         ("anonymized_text", None),
         ("anonymized_file_bytes", None),
         ("mapping_data", None),
+        ("download_data", None),
     ]:
         if key not in st.session_state:
             st.session_state[key] = default
@@ -57,23 +262,37 @@ def render():
     )
 
     if uploaded_file is not None:
-        if st.session_state.uploaded_filename != uploaded_file.name:
+        # Content signature over the whole (already in-memory) file: identical
+        # bytes skip re-extraction, any edit under the same name does not
+        upload_sig = (
+            uploaded_file.name,
+            uploaded_file.size,
+            hashlib.blake2b(uploaded_file.getbuffer(), digest_size=16).digest(),
+        )
+        if st.session_state.upload_sig != upload_sig:
             # New file — store bytes first, then extract text
             st.session_state.uploaded_bytes = get_uploaded_bytes(uploaded_file)
             st.session_state.uploaded_ext = uploaded_file.name.rsplit(".", 1)[-1].lower()
-            st.session_state.uploaded_text = read_uploaded_file(uploaded_file)
+            text = read_uploaded_file(uploaded_file)
+            st.session_state.uploaded_text = text
+            st.session_state.preview_text = text[:2000] + "..." if len(text) > 2000 else text
             st.session_state.uploaded_filename = uploaded_file.name
+            st.session_state.upload_sig = upload_sig
             st.session_state.pass1_result = None
             st.session_state.pass1_confirmed = False
             st.session_state.pass2_result = None
+            st.session_state.pass2_complete = True
             st.session_state.pass2_confirmed = False
             st.session_state.anonymized_text = None
             st.session_state.anonymized_file_bytes = None
             st.session_state.mapping_data = None
+            st.session_state.download_data = None
+
+            # Open the LLM connection while the user reviews the preview
+            warm_up()
 
         with st.expander("File preview", expanded=False):
-            text = st.session_state.uploaded_text
-            st.text(text[:2000] + "..." if len(text) > 2000 else text)
+            st.text(st.session_state.preview_text)
 
     if st.session_state.uploaded_text is None:
         return
@@ -85,13 +304,7 @@ def render():
 
     if st.session_state.pass1_result is None:
         if st.button("Start Pass 1 Scan", type="primary"):
-            with st.spinner("Scanning key sections for entity definitions..."):
-                try:
-                    result = run_first_pass(st.session_state.uploaded_text)
-                    st.session_state.pass1_result = result
-                    st.rerun()
-                except Exception as e:
-                    st.error(f"Pass 1 scan failed: {e}")
+            _scan_pass1()
         return
 
     # Editable entity definition table
@@ -129,22 +342,15 @@ def render():
             st.info("No sensitive items detected")
 
     if not st.session_state.pass1_confirmed:
-        if st.button("Confirm entities, proceed to Pass 2", type="primary"):
-            updated_aliases = []
-            for _, row in edited_aliases.iterrows():
-                if pd.notna(row["Canonical Name"]) and str(row["Canonical Name"]).strip():
-                    updated_aliases.append({
-                        "canonical": str(row["Canonical Name"]).strip(),
-                        "type": str(row["Type"]).strip() if pd.notna(row["Type"]) else "",
-                        "aliases": [
-                            a.strip()
-                            for a in str(row["Aliases"]).split(",")
-                            if a.strip()
-                        ] if pd.notna(row["Aliases"]) else [],
-                    })
-            st.session_state.pass1_result["aliases"] = updated_aliases
-            st.session_state.pass1_confirmed = True
-            st.rerun()
+        col1, col2 = st.columns(2)
+        with col1:
+            if st.button("Confirm entities, proceed to Pass 2", type="primary"):
+                st.session_state.pass1_result["aliases"] = _aliases_from_editor(edited_aliases)
+                st.session_state.pass1_confirmed = True
+                st.rerun()
+        with col2:
+            if st.button("Rescan (ignore cache)", key="pass1_rescan"):
+                _scan_pass1(force=True)
         return
 
     st.success("Entity definitions confirmed")
@@ -155,42 +361,26 @@ def render():
 
     if st.session_state.pass2_result is None:
         if st.button("Start Pass 2 Scan", type="primary"):
-            progress_bar = st.progress(0, text="Scanning document segments...")
-
-            def update_progress(current, total):
-                progress_bar.progress(
-                    current / total,
-                    text=f"Scanning segment {current}/{total}...",
-                )
-
-            try:
-                result = run_second_pass(
-                    st.session_state.uploaded_text,
-                    st.session_state.pass1_result,
-                    progress_callback=update_progress,
-                )
-                st.session_state.pass2_result = result
-                progress_bar.progress(1.0, text="Scan complete!")
-                st.rerun()
-            except Exception as e:
-                st.error(f"Pass 2 scan failed: {e}")
+            _scan_pass2()
         return
 
+    if not st.session_state.pass2_complete:
+        st.error(
+            "Some document segments could not be scanned (LLM errors on every provider). "
+            "Sensitive items in them are missing below and would be left in the output. "
+            "Rescan before anonymizing, or add the missing items manually."
+        )
+
     # Editable full entity list
     st.write("**All sensitive items:**")
 
-    entity_list_data = []
-    for entity in st.session_state.pass2_result:
-        count = st.session_state.uploaded_text.count(entity.get("text", ""))
-        entity_list_data.append({
-            "Text": entity.get("text", ""),
-            "Type": entity.get("type", ""),
-            "Canonical Name": entity.get("canonical", ""),
-            "Occurrences": count,
-        })
+    entity_snapshot = tuple(
+        (entity.get("text", ""), entity.get("type", ""), entity.get("canonical", ""))
+        for entity in st.session_state.pass2_result
+    )
 
-    if entity_list_data:
-        df_entities = pd.DataFrame(entity_list_data)
+    if entity_snapshot:
+        df_entities = _build_entity_table(entity_snapshot, st.session_state.uploaded_text)
         edited_entities = st.data_editor(
             df_entities,
             num_rows="dynamic",
@@ -201,18 +391,15 @@ def render():
         edited_entities = pd.DataFrame(columns=["Text", "Type", "Canonical Name", "Occurrences"])
 
     if not st.session_state.pass2_confirmed:
-        if st.button("Confirm entities, execute anonymization", type="primary"):
-            updated_entities = []
-            for _, row in edited_entities.iterrows():
-                if pd.notna(row["Text"]) and str(row["Text"]).strip():
-                    updated_entities.append({
-                        "text": str(row["Text"]).strip(),
-                        "type": str(row["Type"]).strip() if pd.notna(row["Type"]) else "",
-                        "canonical": str(row["Canonical Name"]).strip() if pd.notna(row["Canonical Name"]) else "",
-                    })
-            st.session_state.pass2_result = updated_entities
-            st.session_state.pass2_confirmed = True
-            st.rerun()
+        col1, col2 = st.columns(2)
+        with col1:
+            if st.button("Confirm entities, execute anonymization", type="primary"):
+                st.session_state.pass2_result = _entities_from_editor(edited_entities)
+                st.session_state.pass2_confirmed = True
+                st.rerun()
+        with col2:
+            if st.button("Rescan (ignore cache)", key="pass2_rescan"):
+                _scan_pass2(force=True)
         return
 
     st.success("Entity list confirmed")
@@ -264,13 +451,15 @@ def render():
         st.text(preview)
 
     # Download buttons — filename based on detected document type (no original info)
+    if st.session_state.download_data is None:
+        st.session_state.download_data = _prepare_downloads(
+            st.session_state.anonymized_text,
+            st.session_state.mapping_data,
+            st.session_state.pass1_result,
+        )
+    downloads = st.session_state.download_data
     col1, col2 = st.columns(2)
     ext = st.session_state.uploaded_ext
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-
-    doc_type = st.session_state.pass1_result.get("document_type", "Document")
-    doc_type_slug = doc_type.upper().replace(" ", "_")
-    anon_filename = f"ANONYMIZED_{doc_type_slug}.{ext}"
 
     with col1:
         if ext in ("docx", "doc") and st.session_state.anonymized_file_bytes:
@@ -282,30 +471,24 @@ def render():
             st.download_button(
                 label=f"Download anonymized file (.{ext})",
                 data=st.session_state.anonymized_file_bytes,
-                file_name=anon_filename,
+                file_name=f"ANONYMIZED_{downloads['doc_type_slug']}.{ext}",
                 mime=mime,
             )
         else:
             st.download_button(
                 label="Download anonymized file (.txt)",
-                data=st.session_state.anonymized_text.encode("utf-8"),
-                file_name=f"ANONYMIZED_{doc_type_slug}.txt",
+                data=downloads["anon_text_bytes"],
+                file_name=f"ANONYMIZED_{downloads['doc_type_slug']}.txt",
                 mime="text/plain",
             )
 
     with col2:
-        mapping_json = json.dumps(
-            st.session_state.mapping_data, ensure_ascii=False, indent=2
-        )
         st.download_button(
             label="Download mapping table (.json)",
-            data=mapping_json.encode("utf-8"),
-            file_name=f"mapping_{timestamp}.json",
+            data=downloads["mapping_json_bytes"],
+            file_name=f"mapping_{downloads['timestamp']}.json",
             mime="application/json",
         )
 
-    try:
-        save_path = save_mapping(st.session_state.mapping_data, "anonymized")
-        st.caption(f"Mapping saved to: {save_path}")
-    except Exception:
-        pass
+    if downloads["save_path"]:
+        st.caption(f"Mapping saved to: {downloads['save_path']}")
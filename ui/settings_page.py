@@ -4,11 +4,35 @@ Settings page — configure LLM API connection and model.
 
 import os
 import streamlit as st
-from core import llm_client
+from core import cache, llm_cache, llm_client
 
 PROJECT_ROOT = os.path.dirname(os.path.dirname(__file__))
 
 
+def _write_env(values: dict):
+    """
+    Write settings to .env, keeping any other lines already in the file
+    (e.g. extra numbered providers LLM_API_BASE_1 / LLM_API_KEY_1 / ...).
+
+    Args:
+        values: Mapping of variable name -> value to set
+    """
+    env_path = os.path.join(PROJECT_ROOT, ".env")
+
+    kept = []
+    if os.path.exists(env_path):
+        with open(env_path, "r") as f:
+            for line in f:
+                name = line.split("=", 1)[0].strip()
+                if name not in values:
+                    kept.append(line if line.endswith("\n") else line + "\n")
+
+    with open(env_path, "w") as f:
+        for name, value in values.items():
+            f.write(f"{name}={value}\n")
+        f.writelines(kept)
+
+
 def render():
     """Render the settings page."""
 
@@ -60,6 +84,22 @@ def render():
     else:
         model = selected
 
+    max_concurrency = st.number_input(
+        "Max concurrent requests",
+        min_value=1,
+        max_value=32,
+        value=min(llm_client.get_max_concurrency(), 32),
+        help="Upper bound on LLM requests in flight during the full-text scan. "
+        "Lower it if the provider returns rate-limit errors.",
+    )
+
+    env_values = {
+        "LLM_API_BASE": api_base,
+        "LLM_API_KEY": api_key,
+        "LLM_MODEL": model,
+        "LLM_MAX_CONCURRENCY": max_concurrency,
+    }
+
     st.divider()
 
     col1, col2 = st.columns(2)
@@ -71,11 +111,7 @@ def render():
                 return
 
             # Write to .env
-            env_path = os.path.join(PROJECT_ROOT, ".env")
-            with open(env_path, "w") as f:
-                f.write(f"LLM_API_BASE={api_base}\n")
-                f.write(f"LLM_API_KEY={api_key}\n")
-                f.write(f"LLM_MODEL={model}\n")
+            _write_env(env_values)
 
             # Reload config in the client module
             llm_client.reload_config()
@@ -97,13 +133,10 @@ def render():
                 st.error("All fields are required.")
                 return
 
-            env_path = os.path.join(PROJECT_ROOT, ".env")
-            with open(env_path, "w") as f:
-                f.write(f"LLM_API_BASE={api_base}\n")
-                f.write(f"LLM_API_KEY={api_key}\n")
-                f.write(f"LLM_MODEL={model}\n")
+            _write_env(env_values)
 
             llm_client.reload_config()
+            llm_client.warm_up()
             st.success("Settings saved.")
 
     # Show current config status
@@ -112,6 +145,24 @@ def render():
     st.code(
         f"API Base: {llm_client.LLM_API_BASE or '(not set)'}\n"
         f"API Key:  {'*' * 8 + llm_client.LLM_API_KEY[-4:] if len(llm_client.LLM_API_KEY) > 4 else '(not set)'}\n"
-        f"Model:    {llm_client.LLM_MODEL or '(not set)'}",
+        f"Model:    {llm_client.LLM_MODEL or '(not set)'}\n"
+        f"Max concurrent requests: {llm_client.get_max_concurrency()}\n"
+        f"Extra providers: {len(llm_client.get_providers()) - 1}",
         language=None,
     )
+
+    # Cached scan results and LLM responses contain document text
+    st.divider()
+    st.subheader("Cache")
+    st.caption(
+        f"Scan results and LLM responses are cached on this machine for "
+        f"{cache.DEFAULT_TTL // 86400} days so re-uploaded documents skip the LLM."
+    )
+    if st.button("Clear cache"):
+        removed_results = cache.clear()
+        removed_responses = llm_cache.clear()
+        st.cache_data.clear()
+        st.success(
+            f"Cleared {removed_results} cached scan results and "
+            f"{removed_responses} cached LLM responses."
+        )